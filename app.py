@@ -1 +1,2 @@
- 
+# Entry point for `gunicorn app:app` (see render.yaml)
+from server import app  # noqa: F401
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from journal import _fsync_dir
+
+logger = logging.getLogger(__name__)
+
+# Rewrite the data file once this much of it belongs to games that were restored
+ARCHIVE_COMPACT_MIN_BYTES = 1 << 20
+
+
+class GameArchive:
+    """Cold storage for games evicted from memory.
+
+    Evicted games are appended as JSON lines to a data file
+    `<path>.<generation>`. A SQLite index, `<path>.db`, maps each game id
+    to the offset and length of its line, the waiting player's username
+    for games with a free seat, so the lobby covers archived games without
+    reading them back, and the stamp the position index checks its entries
+    against (see PositionIndex). The index stays on disk: an eviction pass
+    only inserts its own games, and startup reads ids, not every entry.
+
+    Which games are archived is decided by the journal ("evict" and
+    "restore" records), not by the index: an index entry only says where a
+    game's data is. Data and index are fsynced before the evict records are
+    committed, so a journaled eviction always finds its data. Restoring a
+    game drops its entry; the bytes become garbage that is reclaimed by
+    rewriting the data file into a new generation.
+
+    Thread-safe: one connection, serialized by `lock`; callers serialize
+    changes to any one game.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            username TEXT,  -- the waiting player's, if the game has a free seat
+            created INTEGER NOT NULL,
+            epoch INTEGER NOT NULL,
+            plies INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            generation INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO state (id, generation) VALUES (0, 0);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".db"
+        self._conn = None
+        self._generation = 0
+        self._live_bytes = 0
+        self._dead_bytes = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, game_id):
+        with self.lock:
+            return self._conn.execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def _data_path(self, generation=None):
+        return f"{self.path}.{self._generation if generation is None else generation}"
+
+    def load(self, archived):
+        """Open the index, dropping entries of ids not in `archived`; return archived ids that have no data."""
+        self._conn = sqlite3.connect(self.index_path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Unlike the position index this isn't derived data: a commit must be on disk
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(self.SCHEMA)
+        with self.lock:
+            self._generation = self._conn.execute("SELECT generation FROM state").fetchone()[0]
+            present, stale = set(), []
+            for (game_id,) in self._conn.execute("SELECT game_id FROM games"):
+                if game_id in archived:
+                    present.add(game_id)
+                else:
+                    stale.append(game_id)
+            if stale:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("DELETE FROM games WHERE game_id = ?", [(game_id,) for game_id in stale])
+                self._conn.execute("COMMIT")
+            self._live_bytes = self._conn.execute("SELECT COALESCE(SUM(length), 0) FROM games").fetchone()[0]
+        missing = [game_id for game_id in archived if game_id not in present]
+        for game_id in missing:
+            logger.error("❌ Archived game has no data in the archive", extra={"game_id": game_id})
+        size = os.path.getsize(self._data_path()) if os.path.exists(self._data_path()) else 0
+        self._dead_bytes = size - self._live_bytes
+        return missing
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def open_ids(self):
+        """Ids of the archived games with a free seat."""
+        with self.lock:
+            return {row[0] for row in self._conn.execute("SELECT game_id FROM games WHERE username IS NOT NULL")}
+
+    def open_username(self, game_id):
+        """Username of the waiting player if the archived game has a free seat, else None."""
+        with self.lock:
+            row = self._conn.execute("SELECT username FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return row[0] if row else None
+
+    def stamp(self, game_id):
+        """The stamp stored with an archived game."""
+        with self.lock:
+            return self._conn.execute("SELECT created, epoch, plies FROM games WHERE game_id = ?",
+                                      (game_id,)).fetchone()
+
+    def add(self, games):
+        """Append [(game_id, game dict, open-seat username or None, stamp)] and make them durable."""
+        lines = [(game_id, username, stamp,
+                  json.dumps({"game_id": game_id, "game": data}, separators=(",", ":")).encode("utf-8") + b"\n")
+                 for game_id, data, username, stamp in games]
+        with self.lock:
+            rows = []
+            with open(self._data_path(), "ab") as f:
+                offset = start = f.tell()
+                for game_id, username, stamp, line in lines:
+                    f.write(line)
+                    rows.append((game_id, offset, len(line), username, *stamp))
+                    offset += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+            if start == 0:
+                _fsync_dir(self._data_path())  # a new file
+            self._conn.execute("BEGIN")
+            for row in rows:
+                self._forget(row[0])
+            self._conn.executemany("INSERT INTO games (game_id, offset, length, username, created, epoch, plies)"
+                                   " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self._live_bytes += sum(row[2] for row in rows)
+
+    def read(self, game_id):
+        with self.lock:
+            offset, length = self._conn.execute("SELECT offset, length FROM games WHERE game_id = ?",
+                                                (game_id,)).fetchone()
+            with open(self._data_path(), "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+        return json.loads(data)["game"]
+
+    def forget(self, game_id):
+        with self.lock:
+            self._forget(game_id)
+
+    def _forget(self, game_id):
+        row = self._conn.execute("DELETE FROM games WHERE game_id = ? RETURNING length", (game_id,)).fetchone()
+        if row is not None:
+            self._live_bytes -= row[0]
+            self._dead_bytes += row[0]
+
+    def maybe_compact(self):
+        """Rewrite the data file without restored games once they make up most of it."""
+        with self.lock:
+            return self._compact()
+
+    def _compact(self):
+        if self._dead_bytes < max(self._live_bytes, ARCHIVE_COMPACT_MIN_BYTES):
+            return False
+        old_path = self._data_path()
+        generation = self._generation + 1
+        moved = []
+        with open(old_path, "rb") as src, open(self._data_path(generation), "wb") as dst:
+            for game_id, offset, length in self._conn.execute(
+                    "SELECT game_id, offset, length FROM games ORDER BY offset"):
+                src.seek(offset)
+                moved.append((dst.tell(), game_id))
+                dst.write(src.read(length))
+            dst.flush()
+            os.fsync(dst.fileno())
+        _fsync_dir(self._data_path(generation))
+        self._conn.execute("BEGIN")
+        self._conn.executemany("UPDATE games SET offset = ? WHERE game_id = ?", moved)
+        self._conn.execute("UPDATE state SET generation = ?", (generation,))
+        self._conn.execute("COMMIT")
+        self._generation, self._dead_bytes = generation, 0
+        os.remove(old_path)
+        return True
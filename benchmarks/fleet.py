@@ -0,0 +1,307 @@
+"""Load-test the server with a simulated fleet of paired boards.
+
+    python -m benchmarks.fleet --games 10,100 --plies 20,80 --out baseline.json
+    python -m benchmarks.fleet --gunicorn 1 --compare baseline.json
+    python -m benchmarks.fleet --url http://127.0.0.1:8000
+
+Every game is a pair of devices speaking the real protocol: /start,
+/games/open (the second board looks for the game), /join, then alternating
+/move with the waiting board polling /lastmove in between and every board
+polling the lobby now and then. Moves are random legal moves (seeded, so
+runs are repeatable), so games of any length can be played; a game that
+ends early is reset and continues.
+
+Each scenario (game count x plies per game) runs on a fresh server and
+reports throughput and p50/p95/p99 latency per route. By default the Flask
+test client runs the app in this process, where latencies include waiting
+for the GIL behind the other simulated boards; --gunicorn N starts a local
+gunicorn with N workers (N > 1 needs GAME_STORE=sqlite) and --url targets
+a server that is already running. --out writes the results as JSON and
+--compare fails (exit 1) if a p95 or the throughput regressed by more than
+--tolerance against such a file.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from bitboard import Position
+from game import decode_move
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOBBY_POLL_EVERY = 10  # plies between a board's /games/open polls
+MIN_SAMPLES = 50       # routes with fewer requests are too noisy to compare percentiles
+
+
+class TestClientTarget:
+    """The app in this process, through the Flask test client, on a fresh store in workdir.
+
+    The server module is imported once: importing it again would register
+    its metrics and atexit hooks a second time. Later scenarios swap in a
+    new store instead.
+    """
+
+    def __init__(self, workdir):
+        self.previous_dir = os.getcwd()
+        os.chdir(workdir)
+        loaded = "server" in sys.modules
+        import server
+        if loaded:
+            server.store = server.make_store()
+            server.load_games()
+            server.lobby_cache.clear()
+        self.server = server
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.server.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        self.server.store.close()
+        os.chdir(self.previous_dir)
+
+
+class HTTPTarget:
+    """A server over HTTP, one keep-alive connection per thread."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+
+    def close(self):
+        pass
+
+
+class GunicornTarget(HTTPTarget):
+    """A local gunicorn serving app:app from a scratch directory."""
+
+    def __init__(self, workdir, workers):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = dict(os.environ, PYTHONPATH=ROOT, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", "8",
+             "-b", f"127.0.0.1:{port}", "app:app"], cwd=workdir, env=env)
+        super().__init__(f"http://127.0.0.1:{port}")
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if self.request("GET", "/ping")[0] == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline or self.proc.poll() is not None:
+                self.close()
+                raise RuntimeError("gunicorn did not come up")
+            time.sleep(0.1)
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait(10)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # route -> [seconds]
+        self.errors = {}   # route -> count of unexpected statuses / failures
+
+    def call(self, target, route, method, path, body=None, expect=(200, 304)):
+        started = time.perf_counter()
+        try:
+            status, data = target.request(method, path, body)
+        except OSError:
+            status, data = None, b""
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status not in expect:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, data
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(int(len(sorted_values) * p), len(sorted_values) - 1)]
+
+
+def play_game(target, recorder, game_id, plies, polls, seed):
+    """One pair of boards: create, find in the lobby, join, then play `plies` moves."""
+    rng = random.Random(seed)
+    devices = (f"{game_id}-white", f"{game_id}-black")
+    quoted = urllib.parse.quote(game_id)
+    recorder.call(target, "/start", "POST", "/start",
+                  {"game_id": game_id, "device_id": devices[0], "username": "white"})
+    recorder.call(target, "/games/open", "GET", "/games/open")
+    recorder.call(target, "/join", "POST", "/join",
+                  {"game_id": game_id, "device_id": devices[1], "username": "black"})
+
+    position = Position.initial()
+    for ply in range(plies):
+        moves = position.legal_moves()
+        if not moves:
+            recorder.call(target, "/reset", "POST", "/reset", {"game_id": game_id, "device_id": devices[0]})
+            position = Position.initial()
+            moves = position.legal_moves()
+        code = rng.choice(moves)
+        mover = devices[position.turn]
+        recorder.call(target, "/move", "POST", "/move",
+                      {"game_id": game_id, "device_id": mover, "move": decode_move(code)})
+        position.make_move(code)
+        for _ in range(polls):
+            recorder.call(target, "/lastmove", "GET", f"/lastmove?game_id={quoted}")
+        if ply % LOBBY_POLL_EVERY == 0:
+            recorder.call(target, "/games/open", "GET", "/games/open")
+
+
+def run_scenario(make_target, games, plies, clients, polls, seed):
+    # The seed is in the ids so that runs against one --url server never share games
+    recorder = Recorder()
+    target = make_target()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            futures = [pool.submit(play_game, target, recorder, f"fleet-{seed}-{games}-{plies}-{g}", plies, polls,
+                                   seed + g) for g in range(games)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        target.close()
+
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        routes[route] = {
+            "count": len(samples),
+            "errors": recorder.errors.get(route, 0),
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        }
+    total = sum(route["count"] for route in routes.values())
+    return {"games": games, "plies": plies, "requests": total, "seconds": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 1), "routes": routes}
+
+
+def print_scenario(result):
+    print(f"\n{result['games']} games x {result['plies']} plies: {result['requests']} requests in "
+          f"{result['seconds']:.2f}s = {result['throughput_rps']:.0f} req/s")
+    print(f"  {'route':12s} {'count':>7s} {'errors':>6s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for route, stats in result["routes"].items():
+        print(f"  {route:12s} {stats['count']:7d} {stats['errors']:6d} {stats['p50_ms']:8.2f} "
+              f"{stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against a baseline file's scenarios."""
+    previous = {(s["games"], s["plies"]): s for s in baseline["scenarios"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["games"], result["plies"]))
+        if before is None:
+            continue
+        name = f"{result['games']}x{result['plies']}"
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        for route, stats in result["routes"].items():
+            old = before["routes"].get(route)
+            if old and stats["count"] >= MIN_SAMPLES and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name} {route}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+    return regressions
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int_list, default=[10, 100], help="comma-separated game counts")
+    parser.add_argument("--plies", type=int_list, default=[20, 80], help="comma-separated plies per game")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent simulated boards (threads)")
+    parser.add_argument("--polls", type=int, default=2, help="/lastmove polls by the waiting board per move")
+    parser.add_argument("--seed", type=int, default=1)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--gunicorn", type=int, metavar="WORKERS", help="start a local gunicorn per scenario")
+    target.add_argument("--url", help="an already running server (the seed becomes the time, and it is part of "
+                                       "every game id, so each run plays new games)")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to check against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.url:
+        args.seed = int(time.time())
+        mode = args.url
+    elif args.gunicorn:
+        mode = f"gunicorn -w {args.gunicorn} ({os.environ.get('GAME_STORE', 'memory')} store)"
+    else:
+        mode = f"test client ({os.environ.get('GAME_STORE', 'memory')} store)"
+    print(f"Target: {mode}, {args.clients} clients, {args.polls} polls per move")
+
+    results = []
+    for games in args.games:
+        for plies in args.plies:
+            workdir = tempfile.mkdtemp(prefix="fleet-")
+            if args.url:
+                def make_target():
+                    return HTTPTarget(args.url)
+            elif args.gunicorn:
+                def make_target():
+                    return GunicornTarget(workdir, args.gunicorn)
+            else:
+                def make_target():
+                    return TestClientTarget(workdir)
+            result = run_scenario(make_target, games, plies, args.clients, args.polls, args.seed)
+            print_scenario(result)
+            results.append(result)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"target": mode, "clients": args.clients, "polls": args.polls, "seed": args.seed,
+                       "python": sys.version.split()[0], "scenarios": results}, f, indent=2)
+        print(f"\nBaseline written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
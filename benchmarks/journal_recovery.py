@@ -0,0 +1,101 @@
+"""Check how the journal recovers from a damaged file on startup.
+
+    python -m benchmarks.journal_recovery
+
+Plays a few moves into a journal in a scratch directory, damages the file
+the way a crash or a bad disk would, and reloads it:
+
+- a torn final record (no newline) is cut off, the moves before it come
+  back, and a move appended afterwards survives the next restart;
+- a damaged record in the middle, of the live journal or of a rotated
+  segment, stops the load with JournalCorrupt and leaves the file as it
+  was, so the records after it are never lost.
+
+Exits 1 if any check fails.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+from game_store import MemoryGameStore
+from journal import JournalCorrupt
+
+MOVES = ["e2e4", "e7e5", "g1f3", "b8c6"]
+
+
+def open_store(directory):
+    store = MemoryGameStore(os.path.join(directory, "games.json"), os.path.join(directory, "games.journal"),
+                            fsync_interval=0)
+    store.load()
+    return store
+
+
+def played(directory):
+    """A journal with one game and MOVES in it; returns its path and lines."""
+    store = open_store(directory)
+    store.seat("game", "white", "", None, create=True)
+    for move in MOVES:
+        store.add_move("game", move)
+    store.close()
+    path = os.path.join(directory, "games.journal")
+    with open(path, "rb") as f:
+        return path, f.readlines()
+
+
+def torn_tail(directory, problems):
+    path, lines = played(directory)
+    with open(path, "ab") as f:
+        f.write(lines[-1][:len(lines[-1]) // 2])
+    store = open_store(directory)
+    if store.moves("game") != MOVES:
+        problems.append(f"torn tail: replayed {store.moves('game')}")
+    store.add_move("game", "f1c4")
+    store.close()
+    store = open_store(directory)
+    if store.moves("game") != MOVES + ["f1c4"]:
+        problems.append(f"torn tail: after a restart {store.moves('game')}")
+    store.close()
+
+
+def damaged_middle(directory, problems, segment):
+    path, lines = played(directory)
+    damaged = b"".join(lines[:2] + [b"{garbage\n"] + lines[3:])
+    if segment:
+        # As if compaction had rotated the journal and died before the snapshot
+        os.remove(path)
+        path = f"{path}.{len(lines)}"
+    with open(path, "wb") as f:
+        f.write(damaged)
+    name = "segment" if segment else "journal"
+    try:
+        open_store(directory).close()
+        problems.append(f"damaged {name}: loaded without an error")
+    except JournalCorrupt:
+        pass
+    with open(path, "rb") as f:
+        if f.read() != damaged:
+            problems.append(f"damaged {name}: the file was changed")
+
+
+def main():
+    problems = []
+    for check in (torn_tail,
+                  lambda directory, problems: damaged_middle(directory, problems, segment=False),
+                  lambda directory, problems: damaged_middle(directory, problems, segment=True)):
+        directory = tempfile.mkdtemp(prefix="journal-")
+        try:
+            check(directory, problems)
+        finally:
+            shutil.rmtree(directory)
+
+    if problems:
+        print("Recovery checks failed:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("Journal recovery checks pass")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Memory held by N games: the old dict-of-lists layout vs the packed Game.
+
+    python -m benchmarks.memory --games 10000 100000 --moves 60
+
+Measured with tracemalloc, so it counts Python allocations only (which is
+what the games dict costs in RSS). Games carry what the server keeps per
+game: the position and the checkpoint FENs. The memory store's position
+index lives on disk (see PositionIndex); its file size is reported
+separately.
+"""
+import argparse
+import functools
+import gc
+import os
+import random
+import tempfile
+import tracemalloc
+
+from bitboard import Position
+from game import Game, decode_move, encode_move
+from positions import PositionIndex
+
+@functools.lru_cache(maxsize=None)
+def move_list(length, seed=1):
+    """A legal game of `length` plies: random moves, seeded so runs compare."""
+    rng = random.Random(seed)
+    while True:
+        position, moves = Position.initial(), []
+        while len(moves) < length and position.legal_moves():
+            code = rng.choice(position.legal_moves())
+            position.make_move(code)
+            moves.append(decode_move(code))
+        if len(moves) == length:
+            return tuple(moves)
+
+
+def build_dicts(count, length):
+    # Every move is its own str, as it is after json.load or request parsing
+    return {
+        f"game-{i}": {
+            "owners": [f"white-{i}", f"black-{i}"],
+            "usernames": ["alice", "bob"],
+            "moves": [decode_move(encode_move(m)) for m in move_list(length)],
+            "pin": None
+        }
+        for i in range(count)
+    }
+
+
+def played_game(length):
+    game = Game(["white", "black"], ["alice", "bob"], position=Position.initial())
+    for move in move_list(length):
+        game.push(move)
+    return game
+
+
+def build_games(count, length):
+    # Played once, then copied: every game gets its own arrays, Position and FEN strings
+    played = played_game(length)
+    return {
+        f"game-{i}": Game([f"white-{i}", f"black-{i}"], ["alice", "bob"], moves=played.moves,
+                          position=played.position.copy(),
+                          checkpoints=[(fen + " ")[:-1] for fen in played.checkpoints])
+        for i in range(count)
+    }
+
+
+def index_size(count, length):
+    """Bytes on disk of a PositionIndex holding `count` games of `length` plies."""
+    hashes = played_game(length).zobrist_hashes()
+    with tempfile.TemporaryDirectory() as directory:
+        index = PositionIndex(os.path.join(directory, "positions"))
+        index.open()
+        index.replace((f"game-{i}", hashes, (0, 0, len(hashes))) for i in range(count))
+        index.close()
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def measure(build, count, length):
+    gc.collect()
+    tracemalloc.start()
+    games = build(count, length)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del games
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--moves", type=int, default=60, help="plies per game")
+    args = parser.parse_args()
+
+    print(f"{'games':>8} {'dict layout':>14} {'Game':>14} {'saved':>7} {'per ply':>8} {'index on disk':>14}")
+    for count in args.games:
+        old = measure(build_dicts, count, args.moves)
+        new = measure(build_games, count, args.moves)
+        print(f"{count:8d} {old / 2**20:11.1f} MiB {new / 2**20:11.1f} MiB {1 - new / old:6.0%} "
+              f"{new / (count * args.moves):6.0f} B {index_size(count, args.moves) / 2**20:10.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
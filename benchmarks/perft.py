@@ -0,0 +1,58 @@
+"""Perft correctness check and move generator speed for bitboard.Position.
+
+    python -m benchmarks.perft --depth 3
+
+Counts the legal move tree of well-known positions and compares against
+the published node counts; exits with status 1 on any mismatch, so it can
+gate changes to bitboard.py. Also prints nodes per second.
+"""
+import argparse
+import sys
+import time
+
+from bitboard import START_FEN, Position
+
+# (name, FEN, node counts for depth 1, 2, 3, ...)
+POSITIONS = [
+    ("start", START_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, default=3, help="maximum depth per position")
+    args = parser.parse_args()
+
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in POSITIONS:
+        position = Position.from_fen(fen)
+        for depth in range(1, min(args.depth, len(expected)) + 1):
+            started = time.perf_counter()
+            nodes = position.perft(depth)
+            elapsed = time.perf_counter() - started
+            total_nodes += nodes
+            total_time += elapsed
+            ok = nodes == expected[depth - 1]
+            failures += not ok
+            print(f"{name:12s} depth {depth}: {nodes:9d} nodes {elapsed:7.2f}s "
+                  f"{nodes / elapsed if elapsed else 0:9.0f} nps  {'ok' if ok else f'FAIL expected {expected[depth - 1]}'}")
+        if position.fen() != Position.from_fen(fen).fen():
+            failures += 1
+            print(f"{name:12s} FAIL position not restored after unmake: {position.fen()}")
+
+    print(f"total: {total_nodes} nodes in {total_time:.2f}s = {total_nodes / total_time:.0f} nps")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
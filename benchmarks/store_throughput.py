@@ -0,0 +1,90 @@
+"""Compare GameStore throughput: in-process dict vs SQLite shared by N processes.
+
+    python -m benchmarks.store_throughput --games 500 --moves 40 --workers 4
+
+Each worker creates its own games, seats two players, plays `--moves`
+moves and polls status/last move after every move, like a pair of boards.
+The memory store can only be measured in one process, which is exactly the
+limitation the SQLite store removes.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from game_store import MemoryGameStore, SQLiteGameStore
+
+
+# Knights out and back: legal forever, so games can be any length
+SHUFFLE = ["g1f3", "g8f6", "f3g1", "f6g8"]
+
+
+def run_workload(store, prefix, games, moves):
+    ops = 0
+    for g in range(games):
+        game_id = f"{prefix}-{g}"
+        store.seat(game_id, "white", "w", None, create=True)
+        store.seat(game_id, "black", "b", None)
+        ops += 2
+        for ply in range(moves):
+            store.add_move(game_id, SHUFFLE[ply % len(SHUFFLE)])
+            store.get(game_id)
+            store.last_move(game_id)
+            ops += 3
+        store.moves(game_id)
+        ops += 1
+    return ops
+
+
+def _sqlite_worker(path, prefix, games, moves, results):
+    store = SQLiteGameStore(path)
+    store.load()
+    results.put(run_workload(store, prefix, games, moves))
+    store.close()
+
+
+def bench_memory(tmp, games, moves):
+    store = MemoryGameStore(os.path.join(tmp, "games.json"), os.path.join(tmp, "games.journal"))
+    store.load()
+    started = time.perf_counter()
+    ops = run_workload(store, "mem", games, moves)
+    elapsed = time.perf_counter() - started
+    store.close()
+    return ops, elapsed
+
+
+def bench_sqlite(tmp, games, moves, workers):
+    path = os.path.join(tmp, f"games-{workers}.sqlite3")
+    SQLiteGameStore(path).load()
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_sqlite_worker, args=(path, f"w{i}", games, moves, results))
+             for i in range(workers)]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    ops = sum(results.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return ops, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=200, help="games per worker")
+    parser.add_argument("--moves", type=int, default=40, help="moves per game")
+    parser.add_argument("--workers", type=int, default=4, help="max SQLite worker processes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ops, elapsed = bench_memory(tmp, args.games, args.moves)
+        print(f"memory  1 proc : {ops:8d} ops in {elapsed:6.2f}s = {ops / elapsed:9.0f} ops/s")
+        workers = 1
+        while workers <= args.workers:
+            ops, elapsed = bench_sqlite(tmp, args.games, args.moves, workers)
+            print(f"sqlite {workers:2d} proc : {ops:8d} ops in {elapsed:6.2f}s = {ops / elapsed:9.0f} ops/s")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
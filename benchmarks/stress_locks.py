@@ -0,0 +1,176 @@
+"""Hammer join/move/reset from many threads and check the store's invariants.
+
+    python -m benchmarks.stress_locks --threads 32 --games 8 --seconds 10
+    GAME_STORE=sqlite python -m benchmarks.stress_locks
+
+Runs the app in this process (Flask test client) on a scratch directory,
+with journal compaction and game eviction forced to happen often so they
+race the requests too. Every thread repeatedly picks a game and tries to
+join it with its own device, plays a legal move for one of the owners or
+resets it. Afterwards it checks that:
+
+- exactly one join succeeded per game and no game has more than two owners;
+- version and epoch account for every successful join, move and reset;
+- every move list is legal from the initial position;
+- the lobby indexes agree with the games;
+- (memory store) reloading from disk gives back exactly the same games.
+
+Exits 1 if any invariant is broken.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from bitboard import Position
+from game import decode_move, encode_move
+
+OWNERS = ("owner-white", "owner-black")
+
+
+def worker(client, store, game_ids, deadline, seed, tally, lock):
+    rng = random.Random(seed)
+    device = f"device-{seed}"
+    local = Counter()
+    while time.monotonic() < deadline:
+        game_id = rng.choice(game_ids)
+        action = rng.random()
+        if action < 0.05:
+            response = client.post("/join", json={"game_id": game_id, "device_id": device})
+            if response.status_code == 200 and "second player" in response.get_json()["message"]:
+                local[game_id, "join"] += 1
+        elif action < 0.08:
+            response = client.post("/reset", json={"game_id": game_id, "device_id": OWNERS[0]})
+            if response.status_code == 200:
+                local[game_id, "reset"] += 1
+        else:
+            position = store.position(game_id)
+            moves = position.legal_moves() if position is not None else []
+            if not moves:
+                continue
+            owner = rng.choice(store.get(game_id)["owners"])
+            response = client.post("/move", json={"game_id": game_id, "device_id": owner,
+                                                  "move": decode_move(rng.choice(moves))})
+            if response.status_code == 200:
+                local[game_id, "move"] += 1
+            elif response.status_code != 400:
+                local[game_id, f"move {response.status_code}"] += 1
+    with lock:
+        tally.update(local)
+
+
+def snapshot(store, game_ids):
+    return {game_id: (store.get(game_id), store.moves(game_id)) for game_id in game_ids}
+
+
+def check(store, game_ids, tally, seats):
+    problems = []
+    for game_id in game_ids:
+        game = store.get(game_id)
+        owners = list(game["owners"])
+        joins = tally[game_id, "join"] + seats[game_id]
+        if len(owners) > 2 or len(set(owners)) != len(owners):
+            problems.append(f"{game_id}: owners {owners}")
+        if joins != 1:
+            problems.append(f"{game_id}: {joins} successful joins")
+        expected_version = 1 + joins + tally[game_id, "move"] + tally[game_id, "reset"]
+        if game["version"] != expected_version:
+            problems.append(f"{game_id}: version {game['version']}, expected {expected_version}")
+        if game["epoch"] != tally[game_id, "reset"]:
+            problems.append(f"{game_id}: epoch {game['epoch']}, expected {tally[game_id, 'reset']}")
+        position = Position.initial()
+        for ply, move in enumerate(store.moves(game_id), 1):
+            code = encode_move(move)
+            if not position.is_legal(code):
+                problems.append(f"{game_id}: move {ply} '{move}' is illegal")
+                break
+            position.make_move(code)
+        if store.position(game_id) is not None and store.position(game_id).fen() != position.fen():
+            problems.append(f"{game_id}: stored position differs from the replayed moves")
+        for (tallied_game, what), count in tally.items():
+            if tallied_game == game_id and what.startswith("move ") and count:
+                problems.append(f"{game_id}: {count} moves answered {what[5:]}")
+
+    open_ids = {game_id for game_id, _ in store.open_games()}
+    if set(store.game_ids()) != set(game_ids):
+        problems.append(f"game_ids() lists {sorted(store.game_ids())}")
+    expected_open = {game_id for game_id in game_ids if len(store.get(game_id)["owners"]) == 1}
+    if open_ids != expected_open:
+        problems.append(f"open_games() lists {sorted(open_ids)}, expected {sorted(expected_open)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--games", type=int, default=8, help="games shared by all threads")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="stress-"))
+    # Make maintenance race the requests: compact every few hundred records,
+    # keep at most a couple of games in memory and evict constantly
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("JOURNAL_COMPACT_RECORDS", "300")
+    os.environ.setdefault("EVICT_MAX_HOT_GAMES", str(max(args.games // 4, 1)))
+    os.environ.setdefault("EVICT_INTERVAL", "0.05")
+    import server
+    store = server.store
+
+    game_ids = [f"stress-{i}" for i in range(args.games)]
+    seats = Counter()
+    client = server.app.test_client()
+    for game_id in game_ids:
+        client.post("/start", json={"game_id": game_id, "device_id": OWNERS[0], "username": "white"})
+        # Half the games get their second owner up front, the rest are raced for
+        if len(seats) < args.games // 2:
+            client.post("/join", json={"game_id": game_id, "device_id": OWNERS[1], "username": "black"})
+            seats[game_id] += 1
+
+    tally = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+    threads = [threading.Thread(target=worker, args=(server.app.test_client(), store, game_ids, deadline,
+                                                     args.seed + i, tally, lock))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    moves = sum(count for (_, what), count in tally.items() if what == "move")
+    print(f"{server.GAME_STORE} store, {args.threads} threads, {args.games} games, {args.seconds:.0f}s: "
+          f"{moves} moves, {sum(tally[g, 'reset'] for g in game_ids)} resets, "
+          f"{sum(tally[g, 'join'] for g in game_ids)} raced joins won")
+
+    problems = check(store, game_ids, tally, seats)
+
+    if server.GAME_STORE != "sqlite":
+        before = snapshot(store, game_ids)
+        store.close()
+        from game_store import MemoryGameStore
+        reloaded = MemoryGameStore(server.GAMES_FILE, server.JOURNAL_FILE, archive_path=server.ARCHIVE_FILE,
+                                   positions_path=server.POSITIONS_FILE,
+                                   evict_interval=0)
+        reloaded.load()
+        after = snapshot(reloaded, game_ids)
+        for game_id in game_ids:
+            if before[game_id] != after[game_id]:
+                problems.append(f"{game_id}: differs after reload")
+        reloaded.close()
+
+    if problems:
+        print("Invariants broken:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("All invariants hold")
+
+
+if __name__ == "__main__":
+    main()
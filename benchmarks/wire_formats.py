@@ -0,0 +1,78 @@
+"""Response size and latency of the json, text and bin encodings.
+
+    python -m benchmarks.wire_formats --plies 80 --requests 2000
+
+Plays one game of `--plies` legal moves, opens a few lobby games, then
+requests the read routes through the Flask test client in every format.
+Runs in a temporary directory so no game data is touched.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+ROUTES = [
+    "/moves?game_id=bench",
+    "/moves?game_id=bench&since={since}",
+    "/status?game_id=bench",
+    "/lastmove?game_id=bench",
+    "/board?game_id=bench",
+    "/games/open",
+]
+
+
+def setup(client, plies, lobby_games):
+    from bitboard import Position
+    from game import decode_move
+
+    client.post("/start", json={"game_id": "bench", "device_id": "white", "username": "alice"})
+    client.post("/join", json={"game_id": "bench", "device_id": "black", "username": "bob"})
+    rng = random.Random(42)
+    position = Position.initial()
+    for ply in range(plies):
+        moves = position.legal_moves()
+        if not moves:
+            break
+        code = rng.choice(moves)
+        client.post("/move", json={"game_id": "bench", "device_id": "white", "move": decode_move(code)})
+        position.make_move(code)
+    for i in range(lobby_games):
+        client.post("/start", json={"game_id": f"lobby-{i}", "device_id": f"dev-{i}", "username": f"player{i}"})
+    return ply + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plies", type=int, default=80)
+    parser.add_argument("--lobby-games", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per route and format")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="wire-bench-"))
+    import server
+
+    client = server.app.test_client()
+    plies = setup(client, args.plies, args.lobby_games)
+
+    print(f"{'route':40s} {'fmt':>5s} {'bytes':>7s} {'p50 us':>8s} {'p95 us':>8s}")
+    for route in ROUTES:
+        url = route.format(since=max(plies - 2, 0))
+        sizes = {}
+        for fmt in ("json", "text", "bin"):
+            full = url + ("&" if "?" in url else "?") + f"fmt={fmt}"
+            timings = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = client.get(full)
+                timings.append((time.perf_counter() - started) * 1e6)
+            sizes[fmt] = len(response.get_data())
+            timings.sort()
+            print(f"{url:40s} {fmt:>5s} {sizes[fmt]:7d} {statistics.median(timings):8.0f} "
+                  f"{timings[int(len(timings) * 0.95)]:8.0f}")
+        print(f"{'':40s} {'':>5s} bin is {sizes['bin'] / sizes['json']:.0%} of json\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,611 @@
+"""Bitboard chess position with legal move generation.
+
+Squares are numbered a1=0 .. h8=63. Moves use the packed 16-bit code from
+game.py (from | to << 6 | promotion << 12, promotion 1..4 = n, b, r, q), so
+a Game's move array can be fed straight into make_move().
+
+Every Position also carries its Zobrist hash, kept up to date by
+make_move(); it identifies the placement, side to move, castling rights
+and en-passant square (only when a capture there is possible), so
+transposed move orders reach the same hash.
+"""
+
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_CHARS = "PNBRQKpnbrqk"
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+FULL = (1 << 64) - 1
+RANK_3 = 0xFF << 16
+RANK_6 = 0xFF << 40
+LAST_RANKS = 0xFF | 0xFF << 56
+
+# Castling right bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_CHARS = "KQkq"
+
+
+def _square(file, rank):
+    return rank * 8 + file if 0 <= file < 8 and 0 <= rank < 8 else None
+
+
+def _jumps(deltas):
+    table = []
+    for sq in range(64):
+        bb = 0
+        for df, dr in deltas:
+            to = _square((sq & 7) + df, (sq >> 3) + dr)
+            if to is not None:
+                bb |= 1 << to
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _jumps([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _jumps([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+PAWN_ATTACKS = [_jumps([(-1, 1), (1, 1)]), _jumps([(-1, -1), (1, -1)])]
+
+# Ray directions. The first four increase the square index, so the nearest
+# blocker on them is the lowest set bit; on the last four it is the highest.
+NORTH, EAST, NORTH_EAST, NORTH_WEST, SOUTH, WEST, SOUTH_EAST, SOUTH_WEST = range(8)
+_DIRECTIONS = [(0, 1), (1, 0), (1, 1), (-1, 1), (0, -1), (-1, 0), (1, -1), (-1, -1)]
+ROOK_DIRECTIONS = (NORTH, EAST, SOUTH, WEST)
+BISHOP_DIRECTIONS = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+
+
+def _rays():
+    rays = []
+    for df, dr in _DIRECTIONS:
+        table = []
+        for sq in range(64):
+            bb = 0
+            to = _square((sq & 7) + df, (sq >> 3) + dr)
+            while to is not None:
+                bb |= 1 << to
+                to = _square((to & 7) + df, (to >> 3) + dr)
+            table.append(bb)
+        rays.append(table)
+    return rays
+
+
+RAYS = _rays()
+
+# castling &= CASTLING_MASK[from] & CASTLING_MASK[to] drops the rights a move loses
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[4] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[7] &= ~WHITE_KINGSIDE
+CASTLING_MASK[0] &= ~WHITE_QUEENSIDE
+CASTLING_MASK[60] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[63] &= ~BLACK_KINGSIDE
+CASTLING_MASK[56] &= ~BLACK_QUEENSIDE
+
+
+def _splitmix64(state):
+    while True:
+        state = (state + 0x9E3779B97F4A7C15) & FULL
+        z = state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & FULL
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & FULL
+        yield z ^ (z >> 31)
+
+
+# Zobrist keys. Hashes are stored, so these must never change: they come
+# from a fixed-seed generator written out here rather than `random`.
+_keys = _splitmix64(0xC4E55)
+ZOBRIST_PIECES = [[0] * 64] + [[next(_keys) for _ in range(64)] for _ in range(12)]  # [piece code][square]
+_castling_keys = [next(_keys) for _ in range(4)]
+ZOBRIST_CASTLING = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            ZOBRIST_CASTLING[_rights] ^= _castling_keys[_bit]
+ZOBRIST_EP = [next(_keys) for _ in range(8)]  # by file
+ZOBRIST_BLACK = next(_keys)
+del _keys, _castling_keys, _rights, _bit
+
+
+def slider_attacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if d < 4:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[d][first]
+        attacks |= ray
+    return attacks
+
+
+def square_name(sq):
+    return "abcdefgh"[sq & 7] + str((sq >> 3) + 1)
+
+
+def parse_square(name):
+    if len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678":
+        raise ValueError(f"Invalid square '{name}'")
+    return "abcdefgh".index(name[0]) + 8 * (int(name[1]) - 1)
+
+
+class Position:
+    """A chess position that is updated in place by make_move()/unmake_move().
+
+    `pieces` holds one bitboard per piece type (both colours), `colors` one
+    per side, and `board` is a 64-byte mailbox (0 = empty, otherwise
+    color * 6 + type + 1) for constant-time "what is on this square".
+    """
+
+    __slots__ = ("pieces", "colors", "board", "turn", "castling", "ep", "halfmove", "fullmove", "zobrist")
+
+    def __init__(self):
+        self.pieces = [0] * 6
+        self.colors = [0, 0]
+        self.board = bytearray(64)
+        self.turn = WHITE
+        self.castling = 0
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        self.zobrist = 0
+
+    @classmethod
+    def initial(cls):
+        return cls.from_fen(START_FEN)
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN '{fen}'")
+        position = cls()
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError(f"Invalid FEN '{fen}'")
+        for i, row in enumerate(ranks):
+            rank = 7 - i
+            file = 0
+            for ch in row:
+                if ch.isdigit():
+                    file += int(ch)
+                elif ch in PIECE_CHARS and file < 8:
+                    position._put(rank * 8 + file, PIECE_CHARS.index(ch) + 1)
+                    file += 1
+                else:
+                    raise ValueError(f"Invalid FEN '{fen}'")
+            if file != 8:
+                raise ValueError(f"Invalid FEN '{fen}'")
+        if fields[1] not in ("w", "b"):
+            raise ValueError(f"Invalid FEN '{fen}'")
+        position.turn = WHITE if fields[1] == "w" else BLACK
+        if fields[2] != "-":
+            for ch in fields[2]:
+                if ch not in CASTLING_CHARS:
+                    raise ValueError(f"Invalid FEN '{fen}'")
+                position.castling |= 1 << CASTLING_CHARS.index(ch)
+        position.ep = parse_square(fields[3]) if fields[3] != "-" else -1
+        try:
+            position.halfmove = int(fields[4]) if len(fields) > 4 else 0
+            position.fullmove = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"Invalid FEN '{fen}'") from None
+        for color in (WHITE, BLACK):
+            if bin(position.pieces[KING] & position.colors[color]).count("1") != 1:
+                raise ValueError(f"Invalid FEN '{fen}': each side needs exactly one king")
+        position.zobrist = position.compute_zobrist()
+        return position
+
+    def fen(self):
+        rows = []
+        for rank in range(7, -1, -1):
+            row = ""
+            empty = 0
+            for file in range(8):
+                piece = self.board[rank * 8 + file]
+                if piece:
+                    if empty:
+                        row += str(empty)
+                        empty = 0
+                    row += PIECE_CHARS[piece - 1]
+                else:
+                    empty += 1
+            rows.append(row + (str(empty) if empty else ""))
+        castling = "".join(ch for i, ch in enumerate(CASTLING_CHARS) if self.castling & (1 << i)) or "-"
+        ep = square_name(self.ep) if self.ep >= 0 else "-"
+        return f"{'/'.join(rows)} {'wb'[self.turn]} {castling} {ep} {self.halfmove} {self.fullmove}"
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.pieces = self.pieces[:]
+        position.colors = self.colors[:]
+        position.board = self.board[:]
+        position.turn = self.turn
+        position.castling = self.castling
+        position.ep = self.ep
+        position.halfmove = self.halfmove
+        position.fullmove = self.fullmove
+        position.zobrist = self.zobrist
+        return position
+
+    def _put(self, sq, piece):
+        bit = 1 << sq
+        self.pieces[(piece - 1) % 6] |= bit
+        self.colors[(piece - 1) // 6] |= bit
+        self.board[sq] = piece
+
+    # -- hashing ---------------------------------------------------------
+
+    def _ep_key(self):
+        # The en-passant square only matters if the side to move can take on it
+        ep = self.ep
+        if ep >= 0 and PAWN_ATTACKS[self.turn ^ 1][ep] & self.pieces[PAWN] & self.colors[self.turn]:
+            return ZOBRIST_EP[ep & 7]
+        return 0
+
+    def compute_zobrist(self):
+        """The Zobrist hash from scratch; make_move() maintains it incrementally."""
+        h = ZOBRIST_CASTLING[self.castling] ^ self._ep_key()
+        if self.turn == BLACK:
+            h ^= ZOBRIST_BLACK
+        for sq, piece in enumerate(self.board):
+            if piece:
+                h ^= ZOBRIST_PIECES[piece][sq]
+        return h
+
+    # -- attacks ---------------------------------------------------------
+
+    def attacked(self, sq, by):
+        """Is square sq attacked by side `by`?"""
+        pieces = self.pieces
+        theirs = self.colors[by]
+        occupied = self.colors[0] | self.colors[1]
+        if PAWN_ATTACKS[by ^ 1][sq] & pieces[PAWN] & theirs:
+            return True
+        if KNIGHT_ATTACKS[sq] & pieces[KNIGHT] & theirs:
+            return True
+        if KING_ATTACKS[sq] & pieces[KING] & theirs:
+            return True
+        diagonal = (pieces[BISHOP] | pieces[QUEEN]) & theirs
+        if diagonal and slider_attacks(sq, occupied, BISHOP_DIRECTIONS) & diagonal:
+            return True
+        straight = (pieces[ROOK] | pieces[QUEEN]) & theirs
+        if straight and slider_attacks(sq, occupied, ROOK_DIRECTIONS) & straight:
+            return True
+        return False
+
+    def king_square(self, color):
+        return (self.pieces[KING] & self.colors[color]).bit_length() - 1
+
+    def in_check(self):
+        return self.attacked(self.king_square(self.turn), self.turn ^ 1)
+
+    # -- move generation -------------------------------------------------
+
+    def pseudo_moves(self, from_mask=FULL):
+        """Moves that are legal except that they may leave the own king in check.
+
+        Castling is only generated when it is fully legal.
+        """
+        us = self.turn
+        own = self.colors[us]
+        opp = self.colors[us ^ 1]
+        occupied = own | opp
+        pieces = self.pieces
+        moves = []
+        append = moves.append
+
+        # Pawns
+        pawns = pieces[PAWN] & own & from_mask
+        if pawns:
+            if us == WHITE:
+                single = (pawns << 8) & ~occupied & FULL
+                double = ((single & RANK_3) << 8) & ~occupied & FULL
+                step = 8
+            else:
+                single = (pawns >> 8) & ~occupied
+                double = ((single & RANK_6) >> 8) & ~occupied
+                step = -8
+            targets = single
+            while targets:
+                low = targets & -targets
+                to = low.bit_length() - 1
+                targets ^= low
+                code = (to - step) | to << 6
+                if low & LAST_RANKS:
+                    append(code | 1 << 12)
+                    append(code | 2 << 12)
+                    append(code | 3 << 12)
+                    append(code | 4 << 12)
+                else:
+                    append(code)
+            while double:
+                low = double & -double
+                to = low.bit_length() - 1
+                double ^= low
+                append((to - 2 * step) | to << 6)
+            capturable = opp | (1 << self.ep if self.ep >= 0 else 0)
+            attackers = pawns
+            while attackers:
+                low = attackers & -attackers
+                frm = low.bit_length() - 1
+                attackers ^= low
+                targets = PAWN_ATTACKS[us][frm] & capturable
+                while targets:
+                    tlow = targets & -targets
+                    to = tlow.bit_length() - 1
+                    targets ^= tlow
+                    code = frm | to << 6
+                    if tlow & LAST_RANKS:
+                        append(code | 1 << 12)
+                        append(code | 2 << 12)
+                        append(code | 3 << 12)
+                        append(code | 4 << 12)
+                    else:
+                        append(code)
+
+        # Knights and king
+        for ptype, table in ((KNIGHT, KNIGHT_ATTACKS), (KING, KING_ATTACKS)):
+            movers = pieces[ptype] & own & from_mask
+            while movers:
+                low = movers & -movers
+                frm = low.bit_length() - 1
+                movers ^= low
+                targets = table[frm] & ~own
+                while targets:
+                    tlow = targets & -targets
+                    targets ^= tlow
+                    append(frm | (tlow.bit_length() - 1) << 6)
+
+        # Sliders
+        for ptype, directions in ((BISHOP, BISHOP_DIRECTIONS), (ROOK, ROOK_DIRECTIONS),
+                                  (QUEEN, BISHOP_DIRECTIONS + ROOK_DIRECTIONS)):
+            movers = pieces[ptype] & own & from_mask
+            while movers:
+                low = movers & -movers
+                frm = low.bit_length() - 1
+                movers ^= low
+                targets = slider_attacks(frm, occupied, directions) & ~own
+                while targets:
+                    tlow = targets & -targets
+                    targets ^= tlow
+                    append(frm | (tlow.bit_length() - 1) << 6)
+
+        # Castling
+        king_bb = pieces[KING] & own & from_mask
+        if king_bb and self.castling:
+            them = us ^ 1
+            if us == WHITE:
+                rights = (WHITE_KINGSIDE, WHITE_QUEENSIDE)
+                king, rank_base = 4, 0
+            else:
+                rights = (BLACK_KINGSIDE, BLACK_QUEENSIDE)
+                king, rank_base = 60, 56
+            if king_bb == 1 << king and not self.attacked(king, them):
+                if (self.castling & rights[0] and not occupied & (0x60 << rank_base)
+                        and not self.attacked(king + 1, them) and not self.attacked(king + 2, them)):
+                    append(king | (king + 2) << 6)
+                if (self.castling & rights[1] and not occupied & (0x0E << rank_base)
+                        and not self.attacked(king - 1, them) and not self.attacked(king - 2, them)):
+                    append(king | (king - 2) << 6)
+        return moves
+
+    def legal_moves(self):
+        us = self.turn
+        legal = []
+        for code in self.pseudo_moves():
+            undo = self.make_move(code)
+            if not self.attacked(self.king_square(us), us ^ 1):
+                legal.append(code)
+            self.unmake_move(undo)
+        return legal
+
+    def is_legal(self, code):
+        frm = code & 63
+        piece = self.board[frm]
+        if not piece or (piece - 1) // 6 != self.turn:
+            return False
+        if code not in self.pseudo_moves(1 << frm):
+            return False
+        us = self.turn
+        undo = self.make_move(code)
+        legal = not self.attacked(self.king_square(us), us ^ 1)
+        self.unmake_move(undo)
+        return legal
+
+    def outcome(self):
+        """'checkmate' or 'stalemate' if the side to move has no legal move, else None."""
+        us = self.turn
+        for code in self.pseudo_moves():
+            undo = self.make_move(code)
+            legal = not self.attacked(self.king_square(us), us ^ 1)
+            self.unmake_move(undo)
+            if legal:
+                return None
+        return "checkmate" if self.in_check() else "stalemate"
+
+    # -- notation --------------------------------------------------------
+
+    def san_moves(self):
+        """{SAN without check marks: move code} for every legal move, e.g. {"Nf3": ..., "exd5": ...}."""
+        legal = self.legal_moves()
+        board = self.board
+        sans = {}
+        for code in legal:
+            frm = code & 63
+            to = (code >> 6) & 63
+            promotion = code >> 12
+            ptype = (board[frm] - 1) % 6
+            capture = board[to] or (ptype == PAWN and to == self.ep)
+            if ptype == KING and abs(to - frm) == 2:
+                san = "O-O" if to > frm else "O-O-O"
+            elif ptype == PAWN:
+                san = (square_name(frm)[0] + "x" if capture else "") + square_name(to)
+                if promotion:
+                    san += "=" + "NBRQ"[promotion - 1]
+            else:
+                # Disambiguate by file, else rank, else both
+                rivals = [other & 63 for other in legal
+                          if other != code and (other >> 6) & 63 == to and board[other & 63] == board[frm]]
+                hint = ""
+                if rivals:
+                    if all(r & 7 != frm & 7 for r in rivals):
+                        hint = square_name(frm)[0]
+                    elif all(r >> 3 != frm >> 3 for r in rivals):
+                        hint = square_name(frm)[1]
+                    else:
+                        hint = square_name(frm)
+                san = "NBRQK"[ptype - 1] + hint + ("x" if capture else "") + square_name(to)
+            sans[san] = code
+        return sans
+
+    def san(self, code, sans=None):
+        """Standard algebraic notation of a legal move, with + or # when it gives check or mate."""
+        sans = self.san_moves() if sans is None else sans
+        for san, move in sans.items():
+            if move == code:
+                break
+        else:
+            raise ValueError(f"Illegal move {code}")
+        undo = self.make_move(code)
+        if self.in_check():
+            san += "#" if self.outcome() == "checkmate" else "+"
+        self.unmake_move(undo)
+        return san
+
+    def parse_san(self, text):
+        """The move code of a SAN move ("Nf3", "exd8=Q+", "O-O"); raises ValueError if it isn't legal here."""
+        san = text.rstrip("+#!?").replace("0-0-0", "O-O-O").replace("0-0", "O-O")
+        if san[-1:] in ("N", "B", "R", "Q") and san[-2:-1].isdigit() and san[:1].islower():
+            san = san[:-1] + "=" + san[-1]  # "e8Q" -> "e8=Q"
+        code = self.san_moves().get(san)
+        if code is None:
+            raise ValueError(f"Illegal or unknown move '{text}'")
+        return code
+
+    # -- making moves ----------------------------------------------------
+
+    def make_move(self, code):
+        """Play a pseudo-legal move in place and return what unmake_move() needs."""
+        frm = code & 63
+        to = (code >> 6) & 63
+        promotion = code >> 12
+        board = self.board
+        pieces = self.pieces
+        colors = self.colors
+        us = self.turn
+        them = us ^ 1
+        piece = board[frm]
+        captured = board[to]
+        undo = (code, captured, self.castling, self.ep, self.halfmove, self.zobrist)
+        ptype = (piece - 1) % 6
+        from_bb = 1 << frm
+        to_bb = 1 << to
+        h = self.zobrist ^ self._ep_key() ^ ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_BLACK
+        h ^= ZOBRIST_PIECES[piece][frm] ^ ZOBRIST_PIECES[piece][to]
+
+        if captured:
+            pieces[(captured - 1) % 6] ^= to_bb
+            colors[them] ^= to_bb
+            h ^= ZOBRIST_PIECES[captured][to]
+        pieces[ptype] ^= from_bb | to_bb
+        colors[us] ^= from_bb | to_bb
+        board[frm] = 0
+        board[to] = piece
+
+        ep = -1
+        if ptype == PAWN:
+            if to == self.ep:
+                victim = to - 8 if us == WHITE else to + 8
+                victim_bb = 1 << victim
+                pieces[PAWN] ^= victim_bb
+                colors[them] ^= victim_bb
+                h ^= ZOBRIST_PIECES[board[victim]][victim]
+                board[victim] = 0
+            elif promotion:
+                pieces[PAWN] ^= to_bb
+                pieces[promotion] ^= to_bb
+                board[to] = us * 6 + promotion + 1
+                h ^= ZOBRIST_PIECES[piece][to] ^ ZOBRIST_PIECES[board[to]][to]
+            elif to - frm == 16 or frm - to == 16:
+                ep = (frm + to) >> 1
+            self.halfmove = 0
+        else:
+            if ptype == KING and (to - frm == 2 or frm - to == 2):
+                rook_from, rook_to = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+                rook_bb = 1 << rook_from | 1 << rook_to
+                pieces[ROOK] ^= rook_bb
+                colors[us] ^= rook_bb
+                board[rook_to] = board[rook_from]
+                board[rook_from] = 0
+                h ^= ZOBRIST_PIECES[board[rook_to]][rook_from] ^ ZOBRIST_PIECES[board[rook_to]][rook_to]
+            self.halfmove = 0 if captured else self.halfmove + 1
+
+        self.castling &= CASTLING_MASK[frm] & CASTLING_MASK[to]
+        self.ep = ep
+        if us == BLACK:
+            self.fullmove += 1
+        self.turn = them
+        self.zobrist = h ^ ZOBRIST_CASTLING[self.castling] ^ (self._ep_key() if ep >= 0 else 0)
+        return undo
+
+    def unmake_move(self, undo):
+        code, captured, castling, ep, halfmove, zobrist = undo
+        frm = code & 63
+        to = (code >> 6) & 63
+        promotion = code >> 12
+        board = self.board
+        pieces = self.pieces
+        colors = self.colors
+        them = self.turn
+        us = them ^ 1
+        piece = board[to]
+        from_bb = 1 << frm
+        to_bb = 1 << to
+
+        if promotion:
+            pieces[promotion] ^= to_bb
+            pieces[PAWN] ^= to_bb
+            piece = us * 6 + PAWN + 1
+        ptype = (piece - 1) % 6
+        pieces[ptype] ^= from_bb | to_bb
+        colors[us] ^= from_bb | to_bb
+        board[frm] = piece
+        board[to] = captured
+        if captured:
+            pieces[(captured - 1) % 6] ^= to_bb
+            colors[them] ^= to_bb
+
+        if ptype == PAWN and to == ep:
+            victim = to - 8 if us == WHITE else to + 8
+            victim_bb = 1 << victim
+            pieces[PAWN] ^= victim_bb
+            colors[them] ^= victim_bb
+            board[victim] = them * 6 + PAWN + 1
+        elif ptype == KING and (to - frm == 2 or frm - to == 2):
+            rook_from, rook_to = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+            rook_bb = 1 << rook_from | 1 << rook_to
+            pieces[ROOK] ^= rook_bb
+            colors[us] ^= rook_bb
+            board[rook_from] = board[rook_to]
+            board[rook_to] = 0
+
+        self.castling = castling
+        self.ep = ep
+        self.halfmove = halfmove
+        self.zobrist = zobrist
+        if us == BLACK:
+            self.fullmove -= 1
+        self.turn = us
+
+    def perft(self, depth):
+        """Number of leaf nodes of the legal move tree `depth` plies deep."""
+        moves = self.legal_moves()
+        if depth <= 1:
+            return len(moves) if depth == 1 else 1
+        nodes = 0
+        for code in moves:
+            undo = self.make_move(code)
+            nodes += self.perft(depth - 1)
+            self.unmake_move(undo)
+        return nodes
@@ -0,0 +1,304 @@
+"""Live game events for spectators, over Server-Sent Events and WebSocket.
+
+EventHub runs an asyncio event loop on a daemon thread of the server
+process, with a small HTTP server of its own on EVENTS_PORT:
+
+    GET /events?game_id=ID                         text/event-stream
+    GET /ws?game_id=ID  (Upgrade: websocket)       one text message per event
+
+A subscriber first gets a "game" event with the moves so far, then one
+event per change: {"type": "move", "game_id", "move", "ply"},
+{"type": "reset", "game_id"} and {"type": "delete", "game_id"}, after
+which the stream ends. `ply` lets a client drop a move it already has from
+the initial event.
+
+The store calls publish() for every change while it still holds the
+game's lock (see GameStore.add_listener), so events reach the loop in the
+order the changes were made. publish() encodes the event once per protocol, and the loop thread hands the same bytes to every
+subscriber's queue, so a game with thousands of spectators costs one
+encoding and a queue append per spectator, not one request each. Each
+subscriber has a bounded queue; one that falls `queue_size` events behind
+is disconnected rather than buffered without limit, so a slow reader can
+neither hold up the others nor grow the server's memory.
+
+Only events published in this process reach its subscribers, so the hub
+needs a single worker process (gunicorn -w 1, any number of --threads),
+as the memory store does anyway. With several workers each would need its
+own port and would only see its own moves.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import threading
+import urllib.parse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+MAX_HEADER_BYTES = 8192
+MAX_CLIENT_FRAME = 4096    # spectators only send control frames
+HEADER_TIMEOUT = 10.0      # seconds to send the request head
+KEEPALIVE_SECONDS = 15.0   # idle streams get an SSE comment / WebSocket ping this often
+
+dropped_subscribers = metrics.Counter("chess_event_subscribers_dropped_total",
+                                      "Spectators disconnected for falling behind")
+
+
+def ws_frame(payload, opcode=WS_TEXT):
+    """One unmasked, unfragmented WebSocket frame (server to client)."""
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 1 << 16:
+        header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, "big")
+    else:
+        header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, "big")
+    return header + payload
+
+
+def encode_event(event):
+    """The event as {protocol: bytes on the wire}, encoded once for every subscriber."""
+    data = json.dumps(event, separators=(",", ":")).encode("utf-8")
+    return {
+        "sse": b"event: " + event["type"].encode("utf-8") + b"\ndata: " + data + b"\n\n",
+        "ws": ws_frame(data)
+    }
+
+
+def _response_head(status, headers=()):
+    lines = [f"HTTP/1.1 {status}"] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class _Subscriber:
+    __slots__ = ("protocol", "queue", "writer")
+
+    def __init__(self, protocol, queue_size, writer):
+        self.protocol = protocol
+        self.queue = asyncio.Queue(queue_size)
+        self.writer = writer
+
+    def end(self):
+        """Make the send loop stop after what is already queued, even if the queue is full."""
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                self.queue.get_nowait()
+
+
+class EventHub:
+    """Per-game event fan-out to SSE and WebSocket subscribers (see the module docstring).
+
+    `snapshot(game_id)` returns the fields of the initial "game" event, or
+    None for an unknown game; it runs on the loop's thread pool, so it may
+    block on the store.
+    """
+
+    def __init__(self, host="0.0.0.0", port=0, snapshot=None, queue_size=64, max_subscribers=10000):
+        self.host = host
+        self.port = port
+        self.snapshot = snapshot
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._loop = None
+        self._server = None
+        self._games = {}  # game_id -> set of _Subscriber, touched only on the loop's thread
+        self._count = 0
+
+    def start(self):
+        """Serve on a daemon thread; return the port actually bound. Raises OSError if binding fails."""
+        started = threading.Event()
+        failure = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                self._server = loop.run_until_complete(asyncio.start_server(
+                    self._handle, self.host, self.port, limit=MAX_HEADER_BYTES))
+            except OSError as e:
+                failure.append(e)
+                started.set()
+                loop.close()
+                return
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._loop = loop
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="event-hub", daemon=True).start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        return self.port
+
+    def close(self):
+        loop = self._loop
+        if loop is not None:
+            self._loop = None
+            loop.call_soon_threadsafe(self._server.close)
+            loop.call_soon_threadsafe(loop.stop)
+
+    def subscribers(self):
+        return self._count
+
+    def publish(self, game_id, event_type, **fields):
+        """Send an event to the game's subscribers. Thread-safe; cheap when nobody watches."""
+        loop = self._loop
+        # Read without the loop's help: a subscriber that arrives just now
+        # gets the change in its initial event instead
+        if loop is None or game_id not in self._games:
+            return
+        frames = encode_event(dict(type=event_type, game_id=game_id, **fields))
+        loop.call_soon_threadsafe(self._fan_out, game_id, frames, event_type == "delete")
+
+    # -- loop thread -----------------------------------------------------
+
+    def _fan_out(self, game_id, frames, last):
+        subscribers = self._games.get(game_id, ())
+        for subscriber in list(subscribers):
+            try:
+                subscriber.queue.put_nowait(frames[subscriber.protocol])
+            except asyncio.QueueFull:
+                # Too slow: drop it rather than hold frames for it
+                dropped_subscribers.inc()
+                self._unsubscribe(game_id, subscriber)
+                subscriber.writer.transport.abort()
+                continue
+            if last:
+                subscriber.end()
+        if last:
+            for subscriber in list(subscribers):
+                self._unsubscribe(game_id, subscriber)
+
+    def _subscribe(self, game_id, subscriber):
+        self._games.setdefault(game_id, set()).add(subscriber)
+        self._count += 1
+
+    def _unsubscribe(self, game_id, subscriber):
+        subscribers = self._games.get(game_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        self._count -= 1
+        if not subscribers:
+            del self._games[game_id]
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.split(" ")
+            if len(parts) != 3 or parts[0] != "GET":
+                writer.write(_response_head("405 Method Not Allowed", [("Content-Length", "0")]))
+                return
+            url = urllib.parse.urlsplit(parts[1])
+            game_id = urllib.parse.parse_qs(url.query).get("game_id", [""])[0]
+            if url.path == "/events":
+                protocol = "sse"
+            elif url.path == "/ws" and headers.get("upgrade", "").lower() == "websocket" \
+                    and headers.get("sec-websocket-key"):
+                protocol = "ws"
+            else:
+                writer.write(_response_head("404 Not Found", [("Content-Length", "0")]))
+                return
+            if not game_id:
+                writer.write(_response_head("400 Bad Request", [("Content-Length", "0")]))
+                return
+            if self._count >= self.max_subscribers:
+                writer.write(_response_head("503 Service Unavailable", [("Content-Length", "0")]))
+                return
+            await self._stream(game_id, protocol, headers, reader, writer)
+        except (ConnectionError, OSError):
+            pass
+        except Exception:
+            logger.exception("❌ Event stream failed")
+        finally:
+            writer.close()
+
+    async def _stream(self, game_id, protocol, headers, reader, writer):
+        subscriber = _Subscriber(protocol, self.queue_size, writer)
+        # Subscribe before taking the snapshot, so no change falls between the two
+        self._subscribe(game_id, subscriber)
+        receiver = None
+        try:
+            initial = {}
+            if self.snapshot is not None:
+                initial = await asyncio.get_running_loop().run_in_executor(None, self.snapshot, game_id)
+            if initial is None:
+                writer.write(_response_head("404 Not Found", [("Content-Length", "0")]))
+                return
+
+            if protocol == "sse":
+                writer.write(_response_head("200 OK", [("Content-Type", "text/event-stream"),
+                                                       ("Cache-Control", "no-cache"),
+                                                       ("Access-Control-Allow-Origin", "*"),
+                                                       ("Connection", "close")]))
+                keepalive = b": keepalive\n\n"
+            else:
+                accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest())
+                writer.write(_response_head("101 Switching Protocols", [("Upgrade", "websocket"),
+                                                                        ("Connection", "Upgrade"),
+                                                                        ("Sec-WebSocket-Accept", accept.decode())]))
+                keepalive = ws_frame(b"", WS_PING)
+            writer.write(encode_event(dict(type="game", game_id=game_id, **initial))[protocol])
+            await writer.drain()
+            receiver = asyncio.ensure_future(self._receive(protocol, reader, writer, subscriber))
+
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    frame = keepalive
+                if frame is None:
+                    break
+                writer.write(frame)
+                await writer.drain()
+            if protocol == "ws":
+                writer.write(ws_frame(b"", WS_CLOSE))
+                await writer.drain()
+        finally:
+            self._unsubscribe(game_id, subscriber)
+            if receiver is not None:
+                receiver.cancel()
+
+    async def _receive(self, protocol, reader, writer, subscriber):
+        """Read what the client sends until it goes away, then end the stream."""
+        try:
+            if protocol == "sse":
+                while await reader.read(1024):
+                    pass
+                return
+            while True:
+                first, second = await reader.readexactly(2)
+                opcode, length = first & 0x0F, second & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), "big")
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), "big")
+                if length > MAX_CLIENT_FRAME:
+                    return
+                mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+                if opcode == WS_CLOSE:
+                    return
+                if opcode == WS_PING:
+                    writer.write(ws_frame(payload, WS_PONG))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            subscriber.end()
@@ -0,0 +1,231 @@
+import logging
+from array import array
+
+from bitboard import Position
+
+FILES = "abcdefgh"
+RANKS = "12345678"
+PROMOTIONS = " nbrq"  # index 0 means "no promotion"
+
+logger = logging.getLogger(__name__)
+
+
+class IllegalMove(ValueError):
+    pass
+
+
+def encode_move(uci):
+    """Pack a UCI move ("e2e4", "e7e8q") into 15 bits: from | to << 6 | promotion << 12.
+
+    Raises ValueError for anything that isn't a well-formed UCI move.
+    """
+    if not isinstance(uci, str) or len(uci) not in (4, 5):
+        raise ValueError(f"Invalid move '{uci}'")
+    uci = uci.lower()
+    try:
+        from_sq = FILES.index(uci[0]) + 8 * RANKS.index(uci[1])
+        to_sq = FILES.index(uci[2]) + 8 * RANKS.index(uci[3])
+        promotion = PROMOTIONS.index(uci[4], 1) if len(uci) == 5 else 0
+    except ValueError:
+        raise ValueError(f"Invalid move '{uci}'") from None
+    if from_sq == to_sq:
+        raise ValueError(f"Invalid move '{uci}'")
+    return from_sq | to_sq << 6 | promotion << 12
+
+
+def decode_move(code):
+    from_sq = code & 63
+    to_sq = (code >> 6) & 63
+    promotion = code >> 12
+    return (FILES[from_sq & 7] + RANKS[from_sq >> 3] + FILES[to_sq & 7] + RANKS[to_sq >> 3] +
+            (PROMOTIONS[promotion] if promotion else ""))
+
+
+class Game:
+    """One game held in memory.
+
+    Moves are kept as packed 16-bit codes (see encode_move) in an array, two
+    bytes per ply instead of a str object each. UCI strings only exist at
+    the API boundary and in what is written to disk.
+
+    `position` is the board after the last move, advanced one move at a time
+    by push(). It is None for games stored before moves were validated whose
+    history contains an illegal move; those accept moves unchecked until
+    they are reset.
+
+    `checkpoints[i]` is the FEN after ply (i + 1) * checkpoint_interval, so
+    the board at any ply is at most checkpoint_interval - 1 moves away.
+    """
+
+    __slots__ = ("owners", "usernames", "pin", "moves", "created", "version", "epoch", "position",
+                 "checkpoints", "_outcome")
+
+    checkpoint_interval = 20
+
+    def __init__(self, owners, usernames, pin=None, created=0, version=1, epoch=0, moves=(), position=None,
+                 checkpoints=()):
+        self.owners = tuple(owners)
+        self.usernames = tuple(usernames)
+        self.pin = pin
+        self.moves = array("H", moves)
+        self.created = created
+        self.version = version
+        self.epoch = epoch
+        self.position = position
+        self.checkpoints = list(checkpoints)
+        self._outcome = None  # (version, position.outcome()) as of the last outcome() call
+
+    @property
+    def move_count(self):
+        return len(self.moves)
+
+    def uci_moves(self, since=0):
+        return [decode_move(code) for code in self.moves[since:]]
+
+    def last_move(self):
+        return decode_move(self.moves[-1]) if self.moves else None
+
+    def seat(self, device_id, username):
+        self.owners += (device_id,)
+        self.usernames += (username or "",)
+        self.version += 1
+
+    def push(self, uci):
+        code = encode_move(uci)
+        if self.position is not None:
+            if not self.position.is_legal(code):
+                raise IllegalMove(f"Illegal move '{uci}'")
+            self.position.make_move(code)
+        self.moves.append(code)
+        if self.position is not None and len(self.moves) % self.checkpoint_interval == 0:
+            self.checkpoints.append(self.position.fen())
+        self.version += 1
+
+    def reset(self):
+        self.moves = array("H")
+        self.position = Position.initial()
+        self.checkpoints = []
+        self.version += 1
+        self.epoch += 1
+
+    def outcome(self):
+        """'checkmate', 'stalemate' or None (also for an unvalidated game).
+
+        Cached until the game next changes: the eviction pass asks about
+        every idle game on every pass, and push() shouldn't pay for it.
+        """
+        if self.position is None:
+            return None
+        if self._outcome is None or self._outcome[0] != self.version:
+            self._outcome = (self.version, self.position.outcome())
+        return self._outcome[1]
+
+    def fen_at(self, ply=None):
+        """FEN after `ply` moves (default: now), or None if the game is unvalidated.
+
+        Raises IndexError for a ply outside 0..move_count.
+        """
+        if self.position is None:
+            return None
+        if ply is None or ply == len(self.moves):
+            return self.position.fen()
+        if not 0 <= ply < len(self.moves):
+            raise IndexError(ply)
+        index = ply // self.checkpoint_interval
+        position = Position.from_fen(self.checkpoints[index - 1]) if index else Position.initial()
+        for code in self.moves[index * self.checkpoint_interval:ply]:
+            position.make_move(code)
+        return position.fen()
+
+    def zobrist_hashes(self):
+        """Zobrist hash of the position after each ply, replayed from the moves; empty if unvalidated.
+
+        Not kept per game: only rebuilding the position index needs them all.
+        """
+        if self.position is None:
+            return []
+        position = Position.initial()
+        hashes = []
+        for code in self.moves:
+            position.make_move(code)
+            hashes.append(position.zobrist)
+        return hashes
+
+    def copy(self):
+        """A detached copy, cheap to take under a lock and safe to serialize after it."""
+        return Game(self.owners, self.usernames, pin=self.pin, created=self.created, version=self.version,
+                    epoch=self.epoch, moves=self.moves,
+                    position=self.position.copy() if self.position is not None else None,
+                    checkpoints=self.checkpoints)
+
+    def to_dict(self):
+        return {
+            "owners": list(self.owners),
+            "usernames": list(self.usernames),
+            "moves": self.uci_moves(),
+            "pin": self.pin,
+            "created": self.created,
+            "version": self.version,
+            "epoch": self.epoch,
+            "fen": self.position.fen() if self.position is not None else None,
+            "checkpoints": {"every": self.checkpoint_interval, "fens": self.checkpoints}
+        }
+
+    @classmethod
+    def from_dict(cls, data, game_id=""):
+        """Build a Game from its on-disk dict, including pre-Game games.json entries.
+
+        Old servers stored whatever string a board sent. Nothing after a move
+        that isn't valid UCI can be interpreted, so the list is cut there
+        (GameJournal keeps the original games.json aside as a backup).
+        Entries written before positions were tracked have no "fen"; their
+        position and checkpoints are rebuilt once here, and left
+        unknown if a move is illegal.
+        """
+        codes = []
+        for uci in data.get("moves", []):
+            try:
+                codes.append(encode_move(uci))
+            except ValueError:
+                logger.warning("⚠️ Dropping moves from a non-UCI move on", extra={"game_id": game_id, "move": uci})
+                break
+
+        stored = data.get("checkpoints") or {}
+        if "fen" in data and (not data["fen"] or stored.get("every") == cls.checkpoint_interval):
+            position = Position.from_fen(data["fen"]) if data["fen"] else None
+            checkpoints = stored.get("fens", []) if position is not None else []
+        else:
+            # Positions not stored (or checkpointed at another interval):
+            # replay once, validating only what was never validated before
+            position, checkpoints = cls._replay(codes, validate="fen" not in data, game_id=game_id)
+
+        return cls(data.get("owners", []), data.get("usernames", []), pin=data.get("pin") or None,
+                   created=data.get("created", 0), version=data.get("version", 0),
+                   epoch=data.get("epoch", 0), moves=codes, position=position, checkpoints=checkpoints)
+
+    @classmethod
+    def imported(cls, owners, usernames, moves, pin=None, created=0, game_id=""):
+        """A game brought in from elsewhere, as if its moves had been played here.
+
+        Moves that don't replay legally (an export of a game stored before
+        moves were validated) come in unvalidated, as from_dict() loads them.
+        Raises ValueError for a move that isn't UCI.
+        """
+        codes = [encode_move(uci) for uci in moves]
+        position, checkpoints = cls._replay(codes, validate=True, game_id=game_id)
+        return cls(owners, usernames, pin=pin, created=created, version=len(owners) + len(codes), moves=codes,
+                   position=position, checkpoints=checkpoints)
+
+    @classmethod
+    def _replay(cls, codes, validate, game_id):
+        position = Position.initial()
+        checkpoints = []
+        for ply, code in enumerate(codes, 1):
+            if validate and not position.is_legal(code):
+                logger.warning("⚠️ Illegal move in history, moves won't be validated until the game is reset",
+                               extra={"game_id": game_id, "ply": ply, "move": decode_move(code)})
+                return None, []
+            position.make_move(code)
+            if ply % cls.checkpoint_interval == 0:
+                checkpoints.append(position.fen())
+        return position, checkpoints
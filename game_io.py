@@ -0,0 +1,205 @@
+"""Games as NDJSON and PGN, for /export and /import.
+
+Both directions work one game at a time so neither side ever holds more
+than one game of a large file: export functions turn one stored game into
+text, the readers turn an iterable of lines into game dicts lazily.
+
+A game dict, and one NDJSON line, is
+    {"game_id", "owners", "usernames", "created", "moves": [UCI, ...]}
+plus "pin" where known. PGN carries the same data in tags ([GameId],
+[WhiteDevice], [BlackDevice], [Created], [Pin]) and the moves in SAN.
+"""
+import json
+import re
+import time
+
+from bitboard import WHITE, Position
+from game import decode_move, encode_move
+
+PGN_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+_TAG = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+_MOVE_NUMBER = re.compile(r"^\d+\.+")
+
+
+def normalize(data):
+    """Check an imported game dict and fill in defaults; raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Game must be an object")
+    game_id = data.get("game_id")
+    owners = data.get("owners")
+    if not isinstance(game_id, str) or not game_id:
+        raise ValueError("Missing game_id")
+    # Types first: an unhashable owner would make set() raise TypeError
+    if (not isinstance(owners, list) or not 1 <= len(owners) <= 2 or
+            not all(isinstance(owner, str) and owner for owner in owners) or len(set(owners)) != len(owners)):
+        raise ValueError("owners must list one or two distinct device ids")
+    usernames = data.get("usernames") or []
+    if not isinstance(usernames, list) or not all(name is None or isinstance(name, str) for name in usernames):
+        raise ValueError("usernames must be a list of strings")
+    usernames = [name or "" for name in usernames[:len(owners)]]
+    usernames += [""] * (len(owners) - len(usernames))
+    moves = data.get("moves") or []
+    if not isinstance(moves, list):
+        raise ValueError("moves must be a list")
+    moves = [decode_move(encode_move(move)) for move in moves]
+    created = data.get("created")
+    pin = data.get("pin")
+    if pin and (not isinstance(pin, (str, int)) or isinstance(pin, bool)):
+        raise ValueError("pin must be a string")
+    return {
+        "game_id": game_id,
+        "owners": owners,
+        "usernames": usernames,
+        "pin": str(pin) if pin else None,
+        "created": created if isinstance(created, int) and created > 0 else int(time.time() * 1000),
+        "moves": moves
+    }
+
+
+# -- export ---------------------------------------------------------------
+
+def to_ndjson(game_id, game, moves):
+    """One NDJSON line for a store summary (GameStore.get()) and its UCI moves."""
+    data = {
+        "game_id": game_id,
+        "owners": list(game["owners"]),
+        "usernames": list(game["usernames"]),
+        "created": game["created"],
+        "moves": moves
+    }
+    if game["pin"]:
+        data["pin"] = game["pin"]
+    return json.dumps(data, separators=(",", ":")) + "\n"
+
+
+def _tag(name, value):
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'[{name} "{escaped}"]\n'
+
+
+def to_pgn(game_id, game, moves):
+    """One PGN game. Moves that don't replay legally (games stored before
+    moves were validated) are kept in a [UCIMoves] tag instead of SAN."""
+    position = Position.initial()
+    san = []
+    try:
+        for ply, move in enumerate(moves):
+            code = encode_move(move)
+            if ply % 2 == 0:
+                san.append(f"{ply // 2 + 1}.")
+            san.append(position.san(code))
+            position.make_move(code)
+        legal = True
+    except ValueError:
+        san, legal = [], False
+    outcome = position.outcome() if legal else None
+    if outcome == "checkmate":
+        result = "0-1" if position.turn == WHITE else "1-0"
+    else:
+        result = "1/2-1/2" if outcome == "stalemate" else "*"
+
+    usernames = list(game["usernames"]) + ["", ""]
+    owners = list(game["owners"]) + ["", ""]
+    headers = [
+        _tag("Event", "ESP32 chess"),
+        _tag("Site", "?"),
+        _tag("Date", time.strftime("%Y.%m.%d", time.gmtime(game["created"] / 1000)) if game["created"]
+             else "????.??.??"),
+        _tag("Round", "-"),
+        _tag("White", usernames[0] or "?"),
+        _tag("Black", usernames[1] or "?"),
+        _tag("Result", result),
+        _tag("GameId", game_id),
+        _tag("WhiteDevice", owners[0]),
+        _tag("Created", game["created"]),
+    ]
+    if owners[1]:
+        headers.append(_tag("BlackDevice", owners[1]))
+    if game["pin"]:
+        headers.append(_tag("Pin", game["pin"]))
+    if not legal:
+        headers.append(_tag("UCIMoves", " ".join(moves)))
+
+    lines, line = [], ""
+    for token in san + [result]:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "".join(headers) + "\n" + "\n".join(lines) + "\n\n"
+
+
+# -- import ---------------------------------------------------------------
+
+def read_ndjson(lines):
+    """Yield (game dict, None) or (None, error message) for each non-empty line."""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield normalize(json.loads(line)), None
+        except ValueError as e:
+            yield None, f"line {number}: {e}"
+
+
+def _pgn_games(lines):
+    """Yield (tags, movetext) per PGN game, reading the lines lazily."""
+    tags, movetext = {}, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            if movetext:
+                yield tags, " ".join(movetext)
+                tags, movetext = {}, []
+            match = _TAG.match(line)
+            if match:
+                tags[match.group(1)] = re.sub(r"\\(.)", r"\1", match.group(2))
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+    if tags or movetext:
+        yield tags, " ".join(movetext)
+
+
+def _san_tokens(movetext):
+    """SAN moves of a movetext, without comments, variations, NAGs, numbers and result."""
+    depth = 0
+    for token in re.sub(r"\{[^}]*\}|;[^\n]*", " ", movetext).replace("(", " ( ").replace(")", " ) ").split():
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0 and not token.startswith("$") and token not in PGN_RESULTS:
+            token = _MOVE_NUMBER.sub("", token)
+            if token:
+                yield token
+
+
+def read_pgn(lines):
+    """Yield (game dict, None) or (None, error message) for each PGN game."""
+    for number, (tags, movetext) in enumerate(_pgn_games(lines), 1):
+        try:
+            if "UCIMoves" in tags:
+                moves = tags["UCIMoves"].split()
+            else:
+                position = Position.initial()
+                moves = []
+                for san in _san_tokens(movetext):
+                    code = position.parse_san(san)
+                    position.make_move(code)
+                    moves.append(decode_move(code))
+            owners = [tags.get("WhiteDevice") or ""] + ([tags["BlackDevice"]] if tags.get("BlackDevice") else [])
+            usernames = [tags.get(name, "") for name in ("White", "Black")]
+            created = tags.get("Created", "")
+            yield normalize({
+                "game_id": tags.get("GameId"),
+                "owners": owners,
+                "usernames": ["" if name == "?" else name for name in usernames],
+                "pin": tags.get("Pin"),
+                "created": int(created) if created.isdigit() else None,
+                "moves": moves
+            }), None
+        except ValueError as e:
+            yield None, f"game {number} ({tags.get('GameId', '?')}): {e}"
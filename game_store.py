@@ -0,0 +1,813 @@
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from archive import GameArchive
+from bitboard import START_FEN, Position
+from game import Game, IllegalMove, encode_move
+from journal import GameJournal
+from metrics import persist_seconds
+from positions import PositionIndex, _signed
+
+logger = logging.getLogger(__name__)
+
+# Results of GameStore.seat()
+CREATED = "created"
+JOINED = "joined"
+REJOINED = "rejoined"
+NOT_FOUND = "not_found"
+FULL = "full"
+BAD_PIN = "bad_pin"
+
+# Results of GameStore.import_games()
+IMPORTED = "imported"
+EXISTS = "exists"
+
+
+class GameNotFound(KeyError):
+    pass
+
+
+class StalePly(Exception):
+    """add_move() expected the game at another ply; `move_count` is where it is."""
+
+    def __init__(self, move_count):
+        super().__init__(move_count)
+        self.move_count = move_count
+
+
+def check_seat(owners, game_pin, device_id, pin):
+    """Return why device_id can't take a seat, or None if it can join."""
+    if device_id in owners:
+        return REJOINED
+    if len(owners) >= 2:
+        return FULL
+    if game_pin and pin != game_pin:
+        return BAD_PIN
+    return None
+
+
+class GameStore:
+    """Game state used by the route handlers.
+
+    get() returns a summary dict (owners, usernames, pin, move_count,
+    created, version, epoch) or None. `version` grows with every join, move
+    and reset, `epoch` with every reset, and `created` (ms since the epoch)
+    tells a re-created game apart from a deleted one with the same id.
+
+    The other accessors raise GameNotFound for unknown games. seat() does
+    the whole check-then-act of /start and /join atomically and returns one
+    of the result constants above; add_move() raises game.IllegalMove for
+    a move that is not legal in the current position, and StalePly if it
+    was given the ply the move is for and the game is at another one.
+    """
+
+    # Seconds between re-checks while long-polling, for stores whose writes
+    # can come from other processes and therefore never reach our waiters.
+    poll_interval = None
+
+    _listeners = ()
+
+    def add_listener(self, listener):
+        """Call listener(game_id, event_type, **fields) for every move, reset and delete.
+
+        Events are "move" (with move and ply), "reset" and "delete". The
+        listener runs while the change still holds the game (under its lock,
+        or inside SQLiteGameStore's write transaction), so one game's events
+        arrive in the order the changes were made; it must be quick and must
+        not call back into the store.
+        """
+        self._listeners = self._listeners + (listener,)
+
+    def _changed(self, game_id, event_type, **fields):
+        for listener in self._listeners:
+            listener(game_id, event_type, **fields)
+
+    def load(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def get(self, game_id):
+        raise NotImplementedError
+
+    def game_ids(self, after=None, limit=None):
+        """Return up to `limit` game ids in id order, starting after `after`."""
+        raise NotImplementedError
+
+    def open_games(self, after=None, limit=None):
+        """Like game_ids(), as [(game_id, username)] for games waiting for a second player."""
+        raise NotImplementedError
+
+    def lobby_generation(self):
+        """A number that changes whenever game_ids() or open_games() could."""
+        raise NotImplementedError
+
+    def counts(self):
+        """(number of games, number of open games), for monitoring."""
+        raise NotImplementedError
+
+    def find_position(self, zobrist, after=None, limit=None):
+        """[(game_id, ply)] in id order after `after`: games whose moves reached the position
+        with this Zobrist hash, with the first ply at which they did (the start position,
+        ply 0, is not indexed)."""
+        raise NotImplementedError
+
+    def moves(self, game_id, since=0):
+        raise NotImplementedError
+
+    def export_game(self, game_id):
+        """(get() summary, UCI moves) read together, or None; never brings an archived game back."""
+        raise NotImplementedError
+
+    def last_move(self, game_id):
+        raise NotImplementedError
+
+    def position(self, game_id):
+        """The current bitboard.Position, the caller's to keep, or None if the game is unvalidated."""
+        raise NotImplementedError
+
+    def board(self, game_id, ply=None):
+        """FEN after `ply` moves (default: the current position), None if the game is unvalidated.
+
+        Raises IndexError for a ply outside 0..move_count.
+        """
+        raise NotImplementedError
+
+    def seat(self, game_id, device_id, username, pin, create=False):
+        raise NotImplementedError
+
+    def add_move(self, game_id, move, ply=None):
+        """Append move, only if the game has exactly `ply` moves when given; return the new move count."""
+        raise NotImplementedError
+
+    def reset(self, game_id):
+        raise NotImplementedError
+
+    def delete(self, game_id):
+        raise NotImplementedError
+
+    def import_games(self, games):
+        """Add whole games (game_io.normalize() dicts) whose ids are free.
+
+        Returns IMPORTED or EXISTS for each game, in order. Existing games
+        are never touched; games whose moves aren't legal come in
+        unvalidated (see Game.imported()).
+        """
+        raise NotImplementedError
+
+
+def _imported(data):
+    return Game.imported(data["owners"], data["usernames"], data["moves"], pin=data.get("pin"),
+                         created=data["created"], game_id=data["game_id"])
+
+
+def _stamp(game):
+    # What PositionIndex must hold for the game: anything else is stale.
+    # Unvalidated games have no positions to index
+    return game.created, game.epoch, len(game.moves) if game.position is not None else 0
+
+
+class MemoryGameStore(GameStore):
+    """Games in a process-local dict, persisted through a GameJournal.
+
+    Changes to a game, and reads that need a consistent view of it, hold
+    the journal's game_lock() for that game; `_lobby_lock` is only taken
+    briefly to update the sorted id lists when games are created, filled
+    or deleted. Safe for threaded workers (gunicorn --threads), not for
+    several worker processes.
+
+    With an `archive_path`, games that went unused for `idle_seconds`, or
+    for `finished_seconds` once checkmate or stalemate ended them, are
+    moved to a GameArchive by a background pass every `evict_interval`
+    seconds, least recently used first, and so are the least recently used
+    ones beyond `max_hot` games in memory. At most `evict_batch` games go
+    per pass. Any access brings an archived game back transparently. A
+    threshold of 0 disables it.
+
+    find_position() is served by a PositionIndex at `positions_path`
+    (in memory by default), which covers archived games too.
+    """
+
+    def __init__(self, snapshot_path, journal_path, fsync_interval=0.2, compact_every=10000,
+                 archive_path=None, idle_seconds=0, finished_seconds=0, max_hot=0, evict_interval=60.0,
+                 evict_batch=1000, lock_stripes=64, positions_path=":memory:"):
+        self.games = {}
+        # Sorted ids of all games and of games with a free seat, archived
+        # ones included, kept up to date by seat() and delete() so the lobby
+        # never scans every game
+        self._ids = []
+        self._open_ids = []
+        self._generation = 0
+        self._lobby_lock = threading.Lock()
+        self.journal = GameJournal(self.games, snapshot_path, journal_path,
+                                   fsync_interval=fsync_interval,
+                                   compact_every=compact_every,
+                                   lock_stripes=lock_stripes)
+        self.archive = GameArchive(archive_path) if archive_path else None
+        self.idle_seconds = idle_seconds
+        self.finished_seconds = finished_seconds
+        self.max_hot = max_hot
+        self.evict_interval = evict_interval
+        self.evict_batch = evict_batch
+        self._last_used = {}  # game_id -> time.monotonic() of the last access, for games in memory
+        self._closed = threading.Event()
+        self.positions = PositionIndex(positions_path)
+
+    def load(self):
+        replayed = self.journal.load()
+        with self.journal.exclusive(), self._lobby_lock:
+            archived = self.journal.archived
+            if self.archive is not None:
+                archived.difference_update(self.archive.load(archived))
+            else:
+                archived.clear()
+            self._ids = sorted(set(self.games) | archived)
+            open_archived = self.archive.open_ids() if self.archive is not None else set()
+            self._open_ids = [game_id for game_id in self._ids
+                              if (len(self.games[game_id].owners) == 1 if game_id in self.games
+                                  else game_id in open_archived)]
+            self._last_used = dict.fromkeys(self.games, time.monotonic())
+            self._generation += 1
+            self._reconcile_positions(archived)
+        if self.archive is not None and self.evict_interval > 0:
+            threading.Thread(target=self._evict_loop, name="game-evict", daemon=True).start()
+        return replayed
+
+    def _reconcile_positions(self, archived):
+        """Re-index the games whose PositionIndex stamp disagrees with the journal."""
+        self.positions.open()
+        indexed = self.positions.stamps()
+        stale = []
+        for game_id, game in self.games.items():
+            if indexed.pop(game_id, None) != _stamp(game):
+                stale.append((game_id, game.zobrist_hashes(), _stamp(game)))
+        for game_id in archived:
+            if indexed.pop(game_id, None) != self.archive.stamp(game_id):
+                game = Game.from_dict(self.archive.read(game_id), game_id)
+                stale.append((game_id, game.zobrist_hashes(), _stamp(game)))
+        # Whatever is left was deleted after its last index update
+        self.positions.drop(list(indexed))
+        self.positions.replace(stale)
+        if stale or indexed:
+            logger.info("🔎 Position index updated", extra={"reindexed": len(stale), "dropped": len(indexed)})
+
+    def close(self):
+        self._closed.set()
+        self.journal.close()
+        self.positions.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def _find(self, game_id):
+        """The Game for game_id, brought back from the archive if needed; None if there is none.
+
+        The caller holds the game's lock.
+        """
+        game = self.games.get(game_id)
+        if game is None:
+            if self.archive is None or game_id not in self.archive:
+                return None
+            self.journal.commit({"op": "restore", "game_id": game_id, "game": self.archive.read(game_id)})
+            self.archive.forget(game_id)
+            game = self.games[game_id]
+        self._last_used[game_id] = time.monotonic()
+        return game
+
+    def _game(self, game_id):
+        game = self._find(game_id)
+        if game is None:
+            raise GameNotFound(game_id)
+        return game
+
+    @staticmethod
+    def _summary(game):
+        return {
+            "owners": game.owners,
+            "usernames": game.usernames,
+            "pin": game.pin,
+            "move_count": len(game.moves),
+            "created": game.created,
+            "version": game.version,
+            "epoch": game.epoch
+        }
+
+    def get(self, game_id):
+        with self.journal.game_lock(game_id):
+            game = self._find(game_id)
+            return self._summary(game) if game is not None else None
+
+    @staticmethod
+    def _page(ids, after, limit):
+        start = bisect.bisect_right(ids, after) if after is not None else 0
+        return ids[start:start + limit] if limit is not None else ids[start:]
+
+    def game_ids(self, after=None, limit=None):
+        with self._lobby_lock:
+            return self._page(self._ids, after, limit)
+
+    def open_games(self, after=None, limit=None):
+        with self._lobby_lock:
+            ids = self._page(self._open_ids, after, limit)
+        page = []
+        for game_id in ids:
+            game = self.games.get(game_id)
+            if game is not None:
+                page.append((game_id, game.usernames[0]))
+            elif self.archive is not None and self.archive.open_username(game_id) is not None:
+                page.append((game_id, self.archive.open_username(game_id)))
+        return page
+
+    def lobby_generation(self):
+        return self._generation
+
+    def counts(self):
+        return len(self._ids), len(self._open_ids)
+
+    def find_position(self, zobrist, after=None, limit=None):
+        return self.positions.find(zobrist, after, limit)
+
+    @staticmethod
+    def _discard(ids, game_id):
+        i = bisect.bisect_left(ids, game_id)
+        if i < len(ids) and ids[i] == game_id:
+            del ids[i]
+
+    def moves(self, game_id, since=0):
+        with self.journal.game_lock(game_id):
+            return self._game(game_id).uci_moves(since)
+
+    def export_game(self, game_id):
+        # Reading an archived game in place: an export of every game must
+        # neither load them all into memory nor journal a restore of each
+        with self.journal.game_lock(game_id):
+            game = self.games.get(game_id)
+            if game is None:
+                if self.archive is None or game_id not in self.archive:
+                    return None
+                game = Game.from_dict(self.archive.read(game_id), game_id)
+            return self._summary(game), game.uci_moves()
+
+    def last_move(self, game_id):
+        with self.journal.game_lock(game_id):
+            return self._game(game_id).last_move()
+
+    def position(self, game_id):
+        # A copy: the game's own Position changes under its lock
+        with self.journal.game_lock(game_id):
+            position = self._game(game_id).position
+            return position.copy() if position is not None else None
+
+    def board(self, game_id, ply=None):
+        with self.journal.game_lock(game_id):
+            return self._game(game_id).fen_at(ply)
+
+    def seat(self, game_id, device_id, username, pin, create=False):
+        with self.journal.game_lock(game_id):
+            game = self._find(game_id)
+            if game is None:
+                if not create:
+                    return NOT_FOUND
+                self.journal.commit({"op": "create", "game_id": game_id, "device_id": device_id,
+                                     "username": username or "", "pin": pin or None,
+                                     "created": int(time.time() * 1000)})
+                self._last_used[game_id] = time.monotonic()
+                with self._lobby_lock:
+                    bisect.insort(self._ids, game_id)
+                    bisect.insort(self._open_ids, game_id)
+                    self._generation += 1
+                return CREATED
+            refusal = check_seat(game.owners, game.pin, device_id, pin)
+            if refusal:
+                return refusal
+            self.journal.commit({"op": "join", "game_id": game_id, "device_id": device_id,
+                                 "username": username or ""})
+            with self._lobby_lock:
+                self._discard(self._open_ids, game_id)
+                self._generation += 1
+            return JOINED
+
+    def add_move(self, game_id, move, ply=None):
+        with self.journal.game_lock(game_id):
+            game = self._game(game_id)
+            if ply is not None and ply != len(game.moves):
+                raise StalePly(len(game.moves))
+            self.journal.commit({"op": "move", "game_id": game_id, "move": move})
+            if game.position is not None:
+                self.positions.add(game_id, len(game.moves), game.position.zobrist, _stamp(game))
+            self._changed(game_id, "move", move=move, ply=len(game.moves))
+            return len(game.moves)
+
+    def reset(self, game_id):
+        with self.journal.game_lock(game_id):
+            game = self._game(game_id)
+            self.journal.commit({"op": "reset", "game_id": game_id})
+            self.positions.replace([(game_id, (), _stamp(game))])
+            self._changed(game_id, "reset")
+
+    def delete(self, game_id):
+        with self.journal.game_lock(game_id):
+            self._game(game_id)
+            self.journal.commit({"op": "delete", "game_id": game_id})
+            self.positions.drop([game_id])
+            self._last_used.pop(game_id, None)
+            with self._lobby_lock:
+                self._discard(self._ids, game_id)
+                self._discard(self._open_ids, game_id)
+                self._generation += 1
+            self._changed(game_id, "delete")
+
+    def import_games(self, games):
+        results = []
+        for data in games:
+            game_id = data["game_id"]
+            game = _imported(data)
+            with self.journal.game_lock(game_id):
+                if self._find(game_id) is not None:
+                    results.append(EXISTS)
+                    continue
+                self.journal.commit({"op": "import", "game_id": game_id, "game": game.to_dict()})
+                self._last_used[game_id] = time.monotonic()
+                self.positions.replace([(game_id, game.zobrist_hashes(), _stamp(game))])
+                with self._lobby_lock:
+                    bisect.insort(self._ids, game_id)
+                    if len(game.owners) == 1:
+                        bisect.insort(self._open_ids, game_id)
+                    self._generation += 1
+            results.append(IMPORTED)
+        return results
+
+    def _eviction_candidates(self, now):
+        """Ids to archive now with their last use, least recently used first, at most evict_batch."""
+        by_age = sorted(list(self._last_used.items()), key=lambda item: item[1])
+        chosen = []
+        for game_id, used in by_age:
+            idle = now - used
+            if self.idle_seconds and idle >= self.idle_seconds:
+                chosen.append((game_id, used))
+            elif self.finished_seconds and idle >= self.finished_seconds:
+                with self.journal.game_lock(game_id):
+                    game = self.games.get(game_id)
+                    finished = game is not None and game.outcome() is not None
+                if finished:
+                    chosen.append((game_id, used))
+        if self.max_hot and len(by_age) - len(chosen) > self.max_hot:
+            picked = {game_id for game_id, _ in chosen}
+            extra = [item for item in by_age if item[0] not in picked]
+            chosen += extra[:len(by_age) - len(chosen) - self.max_hot]
+        return chosen[:self.evict_batch]
+
+    def evict(self, now=None):
+        """Move idle, finished and least recently used games to the archive; return how many.
+
+        Games are copied to the archive holding only one game's lock at a
+        time, and then evicted unless they were used in the meantime.
+        """
+        if self.archive is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        copies = []
+        for game_id, used in self._eviction_candidates(now):
+            with self.journal.game_lock(game_id):
+                game = self.games.get(game_id)
+                if game is None:
+                    # Deleted (or evicted) since; an access racing the delete may have left this
+                    self._last_used.pop(game_id, None)
+                    continue
+                copies.append((game_id, used, game.to_dict(), game.usernames[0] if len(game.owners) == 1 else None,
+                               _stamp(game)))
+        if not copies:
+            return 0
+        self.archive.add([(game_id, data, username, stamp) for game_id, _, data, username, stamp in copies])
+
+        evicted = 0
+        for game_id, used, *_ in copies:
+            with self.journal.game_lock(game_id):
+                if game_id in self.games and self._last_used.get(game_id) == used:
+                    self.journal.commit({"op": "evict", "game_id": game_id})
+                    del self._last_used[game_id]
+                    evicted += 1
+                else:
+                    self.archive.forget(game_id)
+        self.archive.maybe_compact()
+        return evicted
+
+    def _evict_loop(self):
+        while not self._closed.wait(self.evict_interval):
+            try:
+                started = time.perf_counter()
+                evicted = self.evict()
+                if evicted:
+                    logger.info("🧊 Games archived", extra={"games": evicted, "hot": len(self.games),
+                                                            "seconds": round(time.perf_counter() - started, 3)})
+            except Exception:
+                logger.exception("❌ Game eviction failed")
+
+
+class SQLiteGameStore(GameStore):
+    """Games in a SQLite database in WAL mode, shareable by several processes.
+
+    Each thread gets its own connection; the statements are constant strings
+    so sqlite3's per-connection statement cache keeps them prepared.
+    """
+
+    poll_interval = 0.5
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            pin TEXT,
+            player_count INTEGER NOT NULL,
+            move_count INTEGER NOT NULL DEFAULT 0,
+            created INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            epoch INTEGER NOT NULL DEFAULT 0,
+            fen TEXT  -- current position; NULL for an unvalidated (imported) game
+        );
+        CREATE INDEX IF NOT EXISTS games_open ON games (player_count, game_id);
+        CREATE TABLE IF NOT EXISTS players (
+            game_id TEXT NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+            seat INTEGER NOT NULL,
+            device_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            PRIMARY KEY (game_id, seat)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS moves (
+            game_id TEXT NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+            ply INTEGER NOT NULL,
+            move TEXT NOT NULL,
+            PRIMARY KEY (game_id, ply)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            game_id TEXT NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+            ply INTEGER NOT NULL,
+            fen TEXT NOT NULL,
+            PRIMARY KEY (game_id, ply)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS positions (
+            game_id TEXT NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+            ply INTEGER NOT NULL,
+            hash INTEGER NOT NULL,  -- Zobrist hash after ply, as a signed 64-bit integer
+            PRIMARY KEY (game_id, ply)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS positions_by_hash ON positions (hash, game_id, ply);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('lobby_generation', 0);
+    """
+
+    def __init__(self, path, busy_timeout=30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _read(self):
+        # One transaction, so multi-statement reads see a single snapshot
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        # Includes waiting for the write lock, which is what contention costs
+        persist_seconds.observe(time.perf_counter() - started, "sqlite_write")
+
+    def load(self):
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        return conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _require(self, conn, game_id):
+        row = conn.execute("SELECT move_count FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        if row is None:
+            raise GameNotFound(game_id)
+        return row[0]
+
+    def get(self, game_id):
+        conn = self._conn()
+        row = conn.execute("SELECT pin, move_count, created, version, epoch FROM games WHERE game_id = ?",
+                           (game_id,)).fetchone()
+        if row is None:
+            return None
+        players = conn.execute("SELECT device_id, username FROM players WHERE game_id = ? ORDER BY seat",
+                               (game_id,)).fetchall()
+        return {
+            "owners": [p[0] for p in players],
+            "usernames": [p[1] for p in players],
+            "pin": row[0],
+            "move_count": row[1],
+            "created": row[2],
+            "version": row[3],
+            "epoch": row[4]
+        }
+
+    def game_ids(self, after=None, limit=None):
+        return [row[0] for row in self._conn().execute(
+            "SELECT game_id FROM games WHERE game_id > ? ORDER BY game_id LIMIT ?",
+            (after if after is not None else "", limit if limit is not None else -1))]
+
+    def open_games(self, after=None, limit=None):
+        return self._conn().execute(
+            "SELECT g.game_id, p.username FROM games g JOIN players p ON p.game_id = g.game_id AND p.seat = 0"
+            " WHERE g.player_count = 1 AND g.game_id > ? ORDER BY g.game_id LIMIT ?",
+            (after if after is not None else "", limit if limit is not None else -1)).fetchall()
+
+    def lobby_generation(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'lobby_generation'").fetchone()[0]
+
+    def counts(self):
+        with self._read() as conn:
+            games = conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+            open_games = conn.execute("SELECT COUNT(*) FROM games WHERE player_count = 1").fetchone()[0]
+        return games, open_games
+
+    def find_position(self, zobrist, after=None, limit=None):
+        return self._conn().execute(
+            "SELECT game_id, MIN(ply) FROM positions WHERE hash = ? AND game_id > ?"
+            " GROUP BY game_id ORDER BY game_id LIMIT ?",
+            (_signed(zobrist), after if after is not None else "", limit if limit is not None else -1)).fetchall()
+
+    def _bump_lobby(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'lobby_generation'")
+
+    def moves(self, game_id, since=0):
+        conn = self._conn()
+        moves = [row[0] for row in conn.execute(
+            "SELECT move FROM moves WHERE game_id = ? AND ply >= ? ORDER BY ply", (game_id, since))]
+        if not moves:
+            self._require(conn, game_id)
+        return moves
+
+    def export_game(self, game_id):
+        with self._read():
+            game = self.get(game_id)
+            return (game, self.moves(game_id)) if game is not None else None
+
+    def last_move(self, game_id):
+        conn = self._conn()
+        row = conn.execute("SELECT move FROM moves WHERE game_id = ? ORDER BY ply DESC LIMIT 1",
+                           (game_id,)).fetchone()
+        if row is None:
+            self._require(conn, game_id)
+            return None
+        return row[0]
+
+    def position(self, game_id):
+        row = self._conn().execute("SELECT fen FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        if row is None:
+            raise GameNotFound(game_id)
+        return Position.from_fen(row[0]) if row[0] else None
+
+    def board(self, game_id, ply=None):
+        with self._read() as conn:
+            row = conn.execute("SELECT move_count, fen FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                raise GameNotFound(game_id)
+            move_count, fen = row
+            if fen is None or ply is None or ply == move_count:
+                return fen
+            if not 0 <= ply < move_count:
+                raise IndexError(ply)
+            checkpoint = conn.execute(
+                "SELECT ply, fen FROM checkpoints WHERE game_id = ? AND ply <= ? ORDER BY ply DESC LIMIT 1",
+                (game_id, ply)).fetchone()
+            base_ply, base_fen = checkpoint or (0, START_FEN)
+            position = Position.from_fen(base_fen)
+            for (move,) in conn.execute("SELECT move FROM moves WHERE game_id = ? AND ply >= ? AND ply < ?"
+                                        " ORDER BY ply", (game_id, base_ply, ply)):
+                position.make_move(encode_move(move))
+            return position.fen()
+
+    def seat(self, game_id, device_id, username, pin, create=False):
+        with self._write() as conn:
+            row = conn.execute("SELECT pin FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                if not create:
+                    return NOT_FOUND
+                conn.execute("INSERT INTO games (game_id, pin, player_count, created, version, fen)"
+                             " VALUES (?, ?, 1, ?, 1, ?)", (game_id, pin or None, int(time.time() * 1000), START_FEN))
+                conn.execute("INSERT INTO players (game_id, seat, device_id, username) VALUES (?, 0, ?, ?)",
+                             (game_id, device_id, username or ""))
+                self._bump_lobby(conn)
+                return CREATED
+            owners = [r[0] for r in conn.execute(
+                "SELECT device_id FROM players WHERE game_id = ? ORDER BY seat", (game_id,))]
+            refusal = check_seat(owners, row[0], device_id, pin)
+            if refusal:
+                return refusal
+            conn.execute("INSERT INTO players (game_id, seat, device_id, username) VALUES (?, ?, ?, ?)",
+                         (game_id, len(owners), device_id, username or ""))
+            conn.execute("UPDATE games SET player_count = player_count + 1, version = version + 1"
+                         " WHERE game_id = ?", (game_id,))
+            self._bump_lobby(conn)
+            return JOINED
+
+    def add_move(self, game_id, move, ply=None):
+        code = encode_move(move)
+        with self._write() as conn:
+            row = conn.execute("SELECT move_count, fen FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                raise GameNotFound(game_id)
+            if ply is not None and ply != row[0]:
+                raise StalePly(row[0])
+            ply, fen = row
+            # The position is carried forward in the row, never rebuilt from the moves
+            if fen:
+                position = Position.from_fen(fen)
+                if not position.is_legal(code):
+                    raise IllegalMove(f"Illegal move '{move}'")
+                position.make_move(code)
+                fen = position.fen()
+                conn.execute("INSERT OR REPLACE INTO positions (game_id, ply, hash) VALUES (?, ?, ?)",
+                             (game_id, ply + 1, _signed(position.zobrist)))
+                if (ply + 1) % Game.checkpoint_interval == 0:
+                    conn.execute("INSERT OR REPLACE INTO checkpoints (game_id, ply, fen) VALUES (?, ?, ?)",
+                                 (game_id, ply + 1, fen))
+            conn.execute("INSERT INTO moves (game_id, ply, move) VALUES (?, ?, ?)", (game_id, ply, move))
+            conn.execute("UPDATE games SET move_count = move_count + 1, version = version + 1, fen = ?"
+                         " WHERE game_id = ?", (fen, game_id))
+            self._changed(game_id, "move", move=move, ply=ply + 1)
+        return ply + 1
+
+    def reset(self, game_id):
+        with self._write() as conn:
+            self._require(conn, game_id)
+            conn.execute("DELETE FROM moves WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM checkpoints WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM positions WHERE game_id = ?", (game_id,))
+            conn.execute("UPDATE games SET move_count = 0, version = version + 1, epoch = epoch + 1, fen = ?"
+                         " WHERE game_id = ?", (START_FEN, game_id))
+            self._changed(game_id, "reset")
+
+    def delete(self, game_id):
+        with self._write() as conn:
+            self._require(conn, game_id)
+            conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+            self._bump_lobby(conn)
+            self._changed(game_id, "delete")
+
+    def import_games(self, games):
+        # Replay outside the transaction, then write the whole batch at once
+        games = [(data, _imported(data)) for data in games]
+        results = []
+        with self._write() as conn:
+            for data, game in games:
+                game_id = data["game_id"]
+                if conn.execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone():
+                    results.append(EXISTS)
+                    continue
+                conn.execute("INSERT INTO games (game_id, pin, player_count, move_count, created, version, fen)"
+                             " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (game_id, game.pin, len(game.owners), len(game.moves), game.created, game.version,
+                              game.position.fen() if game.position is not None else None))
+                conn.executemany("INSERT INTO players (game_id, seat, device_id, username) VALUES (?, ?, ?, ?)",
+                                 [(game_id, seat, device_id, username) for seat, (device_id, username)
+                                  in enumerate(zip(game.owners, game.usernames))])
+                conn.executemany("INSERT INTO moves (game_id, ply, move) VALUES (?, ?, ?)",
+                                 [(game_id, ply, move) for ply, move in enumerate(game.uci_moves())])
+                conn.executemany("INSERT INTO checkpoints (game_id, ply, fen) VALUES (?, ?, ?)",
+                                 [(game_id, (i + 1) * Game.checkpoint_interval, fen)
+                                  for i, fen in enumerate(game.checkpoints)])
+                conn.executemany("INSERT INTO positions (game_id, ply, hash) VALUES (?, ?, ?)",
+                                 [(game_id, ply, _signed(zobrist))
+                                  for ply, zobrist in enumerate(game.zobrist_hashes(), 1)])
+                results.append(IMPORTED)
+            if IMPORTED in results:
+                self._bump_lobby(conn)
+        return results
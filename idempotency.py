@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+
+
+class KeyReused(Exception):
+    """A request id sent again with a different request."""
+
+
+class _Pending:
+    __slots__ = ("fingerprint", "done", "result")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+
+
+class RecentResults:
+    """Results of recent requests by device and request id, for answering retries.
+
+    A board that lost the answer to a request resends it with the same
+    request id and gets the first answer back instead of having it applied
+    twice. Each device keeps its last `per_device` request ids and at most
+    `max_devices` devices are remembered, least recently active dropped
+    first, so memory stays bounded whatever clients send. A retry arriving
+    while the original is still running waits up to `wait_timeout` seconds
+    for its result.
+
+    The results live in this process only: with several workers a retry
+    can land on one that never saw the original, so callers that must not
+    apply a request twice need a check in the store as well.
+    """
+
+    def __init__(self, per_device=32, max_devices=10000, wait_timeout=10.0):
+        self.per_device = per_device
+        self.max_devices = max_devices
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._devices = OrderedDict()  # device_id -> OrderedDict(key -> _Pending), least recent first
+
+    def run(self, device_id, key, compute, fingerprint=None):
+        """compute() the first time device_id sends key; the same result for its retries.
+
+        `fingerprint` identifies what the request asks for. A retry must
+        carry the same one, else KeyReused is raised: the id was reused for
+        another request, which must neither be applied nor get the first
+        request's answer. If the original raised, or is still running after
+        wait_timeout, the retry computes its own result (and nothing is
+        remembered for it).
+        """
+        with self._lock:
+            requests = self._devices.get(device_id)
+            if requests is None:
+                requests = self._devices[device_id] = OrderedDict()
+                while len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+            else:
+                self._devices.move_to_end(device_id)
+            pending = requests.get(key)
+            first = pending is None
+            if first:
+                pending = requests[key] = _Pending(fingerprint)
+                while len(requests) > self.per_device:
+                    requests.popitem(last=False)
+
+        if not first:
+            if pending.fingerprint != fingerprint:
+                raise KeyReused(key)
+            pending.done.wait(self.wait_timeout)
+            if pending.result is not None:
+                return pending.result
+            return compute()
+
+        try:
+            pending.result = compute()
+        except BaseException:
+            with self._lock:
+                requests = self._devices.get(device_id)
+                if requests is not None and requests.get(key) is pending:
+                    del requests[key]
+            raise
+        finally:
+            pending.done.set()
+        return pending.result
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(requests) for requests in self._devices.values())
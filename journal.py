@@ -0,0 +1,327 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from bitboard import Position
+from game import Game, IllegalMove
+from metrics import persist_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def apply_record(games, record, archived=None):
+    """Apply one journal record to a {game_id: Game} dict and the set of archived ids.
+
+    Used both for live requests and for replay on startup, so the two can
+    never disagree about what a record means.
+    """
+    op = record["op"]
+    game_id = record["game_id"]
+    if op == "create":
+        games[game_id] = Game([record["device_id"]], [record.get("username") or ""],
+                              pin=record.get("pin") or None, created=record.get("created", 0),
+                              position=Position.initial())
+    elif op == "join":
+        games[game_id].seat(record["device_id"], record.get("username"))
+    elif op == "move":
+        games[game_id].push(record["move"])
+    elif op == "reset":
+        games[game_id].reset()
+    elif op == "delete":
+        games.pop(game_id, None)
+    elif op == "evict":
+        del games[game_id]
+        if archived is not None:
+            archived.add(game_id)
+    elif op in ("restore", "import"):
+        # Carries the whole game, so replay never has to read the archive
+        # or the imported file
+        games[game_id] = Game.from_dict(record["game"], game_id)
+        if archived is not None:
+            archived.discard(game_id)
+    else:
+        raise ValueError(f"Unknown journal op '{op}'")
+
+
+class JournalCorrupt(Exception):
+    """A journal line that can't be read and isn't a torn final write."""
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class GameJournal:
+    """Append-only journal of game mutations with periodic snapshots.
+
+    Every mutation is one JSON line carrying a sequence number. Lines are
+    handed to the OS immediately, so a crash of the process loses nothing;
+    fsync is batched by a background thread every `fsync_interval` seconds
+    (0 means fsync on every record), which bounds what a power loss can
+    lose. Once `compact_every` records have accumulated, the background
+    thread rotates the journal into a numbered segment and folds everything
+    into `snapshot_path` with an atomic rename. Records already covered by
+    the snapshot are skipped on replay, so a crash at any point during
+    compaction is safe.
+
+    `archived` holds the ids of games evicted to a GameArchive; the
+    snapshot lists them so a restart knows which archive entries are live.
+
+    Commits on one game are serialized by its game_lock(), a stripe of
+    `lock_stripes` locks shared by the ids that hash to it, so requests on
+    different games rarely contend; `lock` only orders the appends.
+    Compaction takes every stripe, so no commit is half done while the
+    snapshot is taken.
+    """
+
+    def __init__(self, games, snapshot_path, journal_path, fsync_interval=0.2, compact_every=10000,
+                 lock_stripes=64):
+        self.games = games
+        self.archived = set()
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self._stripes = [threading.RLock() for _ in range(lock_stripes)]
+        self._file = None
+        self._seq = 0
+        self._since_compact = 0
+        self._dirty = False
+        self._wake = threading.Event()
+        self._compact_requested = False
+        self._closed = False
+        self._thread = None
+
+    def game_lock(self, game_id):
+        """The lock to hold while committing to, or reading a consistent view of, game_id."""
+        return self._stripes[hash(game_id) % len(self._stripes)]
+
+    @contextmanager
+    def exclusive(self):
+        """Hold every game lock and the append lock: no commit is in flight."""
+        with ExitStack() as stack:
+            for lock in self._stripes:
+                stack.enter_context(lock)
+            stack.enter_context(self.lock)
+            yield
+
+    # -- startup ---------------------------------------------------------
+
+    def load(self):
+        """Load the snapshot, replay the journal and open it for appending.
+
+        A torn record at the very end is cut off. A damaged record anywhere
+        else raises JournalCorrupt and leaves every file as it is, for an
+        operator to repair.
+        """
+        with self.lock:
+            snapshot_seq = self._load_snapshot()
+            self._seq = snapshot_seq
+            replayed = 0
+            for path in self._segments() + [self.journal_path]:
+                replayed += self._replay(path, snapshot_seq)
+            self._since_compact = replayed
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._background, name="game-journal", daemon=True)
+        self._thread.start()
+        return replayed
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return 0
+        with open(self.snapshot_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        seq = 0
+        if isinstance(data.get("games"), dict) and isinstance(data.get("seq"), int):
+            self.archived.update(data.get("archived", []))
+            seq, data = data["seq"], data["games"]
+        else:
+            # A pre-journal games.json, a bare {game_id: game} dict
+            self._keep_legacy_snapshot()
+        for game_id, game in data.items():
+            self.games[game_id] = Game.from_dict(game, game_id)
+        return seq
+
+    def _keep_legacy_snapshot(self):
+        """Copy a pre-journal games.json aside before the first compaction replaces it.
+
+        from_dict() cuts a game's moves at the first one that isn't UCI, so
+        the snapshot written over it may hold less than the original did.
+        An existing copy is never overwritten: it is the only original.
+        """
+        backup_path = self.snapshot_path + ".legacy"
+        if os.path.exists(backup_path):
+            return
+        tmp_path = backup_path + ".tmp"
+        shutil.copyfile(self.snapshot_path, tmp_path)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, backup_path)
+        _fsync_dir(backup_path)
+        logger.warning("⚠️ Pre-journal games file kept as a backup", extra={"path": backup_path})
+
+    def _segments(self):
+        def seq_of(path):
+            return int(path.rsplit(".", 1)[1])
+        paths = [p for p in glob.glob(glob.escape(self.journal_path) + ".*")
+                 if p.rsplit(".", 1)[1].isdigit()]
+        return sorted(paths, key=seq_of)
+
+    def _replay(self, path, snapshot_seq):
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        complete = 0  # bytes of whole records read so far
+        with open(path, "rb") as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    # Only the last line can lack its newline: a torn write from a crash
+                    break
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict) or not isinstance(record.get("seq"), int):
+                        raise ValueError("not a journal record")
+                except ValueError as e:
+                    # Damage, not a torn write: records after it may be intact,
+                    # and replaying around the gap would be a guess
+                    raise JournalCorrupt(f"{path}, line {number} (byte {complete}): {e}") from None
+                complete += len(line)
+                if record["seq"] <= snapshot_seq:
+                    continue
+                try:
+                    apply_record(self.games, record, self.archived)
+                except IllegalMove:
+                    # Recorded before moves were validated: keep it, stop validating the game
+                    self.games[record["game_id"]].position = None
+                    apply_record(self.games, record, self.archived)
+                except (KeyError, IndexError, ValueError) as e:
+                    logger.warning("⚠️ Skipping a journal record that doesn't apply",
+                                   extra={"seq": record["seq"], "op": record.get("op"),
+                                          "game_id": record.get("game_id"), "error": repr(e)})
+                self._seq = max(self._seq, record["seq"])
+                replayed += 1
+        size = os.path.getsize(path)
+        if complete < size:
+            # Cut the torn tail off, or the next append would be glued to it
+            # and lost, with everything after it, on the next replay
+            logger.warning("⚠️ Truncating a torn journal record", extra={"path": path, "bytes": size - complete})
+            os.truncate(path, complete)
+        return replayed
+
+    # -- writes ----------------------------------------------------------
+
+    def commit(self, record):
+        """Apply record to the games dict and append it to the journal.
+
+        The caller holds game_lock(record["game_id"]).
+        """
+        apply_record(self.games, record, self.archived)
+        with self.lock:
+            started = time.perf_counter()
+            self._seq += 1
+            record = dict(record, seq=self._seq)
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+            if self.fsync_interval <= 0:
+                os.fsync(self._file.fileno())
+            else:
+                self._dirty = True
+            persist_seconds.observe(time.perf_counter() - started, "journal_append")
+            self._since_compact += 1
+            if self._since_compact >= self.compact_every and not self._compact_requested:
+                self._compact_requested = True
+                self._wake.set()
+
+    def sync(self):
+        # fsync a duplicate descriptor outside the lock, so commits keep
+        # appending (and compaction may rotate the file) while the disk flushes
+        with self.lock:
+            if not self._dirty or self._file is None:
+                return
+            fd = os.dup(self._file.fileno())
+            self._dirty = False
+        started = time.perf_counter()
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        persist_seconds.observe(time.perf_counter() - started, "journal_fsync")
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot written with an atomic rename."""
+        with self.exclusive():
+            if self._file is None:
+                return
+            # Only copy under the locks; encoding every game waits until
+            # commits can run again
+            games = {game_id: game.copy() for game_id, game in self.games.items()}
+            archived = sorted(self.archived)
+            seq = self._seq
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._dirty = False
+            if os.path.exists(self.journal_path):
+                os.replace(self.journal_path, f"{self.journal_path}.{seq}")
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+            self._since_compact = 0
+            self._compact_requested = False
+
+        payload = json.dumps({"seq": seq, "games": {game_id: game.to_dict() for game_id, game in games.items()},
+                              "archived": archived})
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_dir(self.snapshot_path)
+
+        for path in self._segments():
+            if int(path.rsplit(".", 1)[1]) <= seq:
+                os.remove(path)
+
+    def close(self):
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.set()
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def _background(self):
+        interval = self.fsync_interval if self.fsync_interval > 0 else 1.0
+        while not self._closed:
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                self.sync()
+                if self._compact_requested:
+                    started = time.perf_counter()
+                    self.compact()
+                    elapsed = time.perf_counter() - started
+                    persist_seconds.observe(elapsed, "journal_compact")
+                    logger.info("💾 Journal compacted", extra={"seconds": round(elapsed, 3)})
+            except Exception:
+                logger.exception("❌ Journal maintenance failed")
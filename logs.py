@@ -0,0 +1,84 @@
+"""Logging setup: level-gated, structured, and off the request thread.
+
+Modules log through logging.getLogger(__name__) and pass fields with
+`extra={...}`. setup_logging() puts a QueueHandler on the root logger, so a
+request thread only enqueues the record; a QueueListener thread formats it
+and writes it to stderr. Fields come out as key=value pairs after the
+message, or as one JSON object per line with LOG_FORMAT=json.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_STANDARD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD}
+
+
+def _timestamp(record):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Make the record picklable and thread-independent, but keep the
+        # traceback apart from the message so formatters can place it
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{_timestamp(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        for key, value in _fields(record).items():
+            value = str(value)
+            if not value or any(c in value for c in ' ="'):
+                value = json.dumps(value, ensure_ascii=False)
+            line += f" {key}={value}"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": _timestamp(record), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update(_fields(record))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", fmt="text"):
+    """Route the root logger through a queue to stderr. Safe to call more than once."""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(JSONFormatter() if fmt == "json" else KeyValueFormatter())
+    records = queue.SimpleQueue()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
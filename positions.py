@@ -0,0 +1,173 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+COMMIT_EVERY = 1000  # queued changes applied per transaction, at most
+
+
+def _signed(zobrist):
+    # SQLite integers are signed 64-bit
+    return zobrist - (1 << 64) if zobrist >= 1 << 63 else zobrist
+
+
+class PositionIndex:
+    """Which games reached a position, by Zobrist hash, for MemoryGameStore.
+
+    Kept in a SQLite file rather than in memory, with the same positions
+    table as SQLiteGameStore, so it costs no memory per ply and a page of
+    matches is read straight off the (hash, game_id, ply) index. The
+    default path ":memory:" keeps it in SQLite's own pages instead.
+
+    The index is derived data. `games` holds the stamp (created, epoch,
+    number of indexed plies) of every indexed game as of its last update,
+    and MemoryGameStore.load() re-indexes every game whose stamp differs
+    from what the journal says. Writes therefore never fsync, and a lost
+    or unreadable file is simply rebuilt.
+
+    add(), replace() and drop() only queue the change: a writer thread
+    applies the queue in order, up to COMMIT_EVERY changes per
+    transaction, so a move never waits for SQLite, a commit, or a move on
+    another game. A search may miss the last few milliseconds of moves.
+
+    Thread-safe: one connection, serialized by `lock`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS positions (
+            game_id TEXT NOT NULL,
+            ply INTEGER NOT NULL,
+            hash INTEGER NOT NULL,  -- Zobrist hash after ply, as a signed 64-bit integer
+            PRIMARY KEY (game_id, ply)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS positions_by_hash ON positions (hash, game_id, ply);
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            created INTEGER NOT NULL,
+            epoch INTEGER NOT NULL,
+            plies INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+        self._queue = queue.SimpleQueue()  # (function, *args), an Event to set, or None to stop
+        self._writer = None
+
+    def open(self):
+        try:
+            self._connect()
+        except sqlite3.DatabaseError:
+            logger.warning("⚠️ Position index unreadable, rebuilding it", extra={"path": self.path})
+            if self._conn is not None:
+                self._conn.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            self._connect()
+        self._writer = threading.Thread(target=self._write_loop, name="position-index", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Rebuilt from the journal if the last commits are lost
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def close(self):
+        """Apply what is queued, then close."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def flush(self):
+        """Wait until every change queued so far is applied."""
+        applied = threading.Event()
+        self._queue.put(applied)
+        applied.wait()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < COMMIT_EVERY:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.lock:
+                    self._conn.execute("BEGIN")
+                    for item in batch:
+                        if isinstance(item, tuple):
+                            item[0](self._conn, *item[1:])
+                    self._conn.execute("COMMIT")
+            except Exception:
+                # The stamps roll back with the rows, so the next load() re-indexes these games
+                logger.exception("❌ Position index update failed")
+                with self.lock:
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if any(item is None for item in batch):
+                return
+
+    def stamps(self):
+        """{game_id: (created, epoch, plies)} of every indexed game."""
+        with self.lock:
+            return {row[0]: tuple(row[1:]) for row in
+                    self._conn.execute("SELECT game_id, created, epoch, plies FROM games")}
+
+    def add(self, game_id, ply, zobrist, stamp):
+        """Index the position after `ply` of a game, whose stamp is then `stamp`."""
+        self._queue.put((self._add, game_id, ply, zobrist, stamp))
+
+    def replace(self, games):
+        """Re-index [(game_id, hashes after each ply, stamp)] from scratch."""
+        self._queue.put((self._replace, games))
+
+    def drop(self, game_ids):
+        self._queue.put((self._drop, game_ids))
+
+    @staticmethod
+    def _add(conn, game_id, ply, zobrist, stamp):
+        conn.execute("INSERT OR REPLACE INTO positions (game_id, ply, hash) VALUES (?, ?, ?)",
+                     (game_id, ply, _signed(zobrist)))
+        conn.execute("INSERT OR REPLACE INTO games (game_id, created, epoch, plies) VALUES (?, ?, ?, ?)",
+                     (game_id, *stamp))
+
+    @staticmethod
+    def _replace(conn, games):
+        for game_id, hashes, stamp in games:
+            conn.execute("DELETE FROM positions WHERE game_id = ?", (game_id,))
+            conn.executemany("INSERT INTO positions (game_id, ply, hash) VALUES (?, ?, ?)",
+                             [(game_id, ply, _signed(zobrist)) for ply, zobrist in enumerate(hashes, 1)])
+            conn.execute("INSERT OR REPLACE INTO games (game_id, created, epoch, plies) VALUES (?, ?, ?, ?)",
+                         (game_id, *stamp))
+
+    @staticmethod
+    def _drop(conn, game_ids):
+        for game_id in game_ids:
+            conn.execute("DELETE FROM positions WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+
+    def find(self, zobrist, after=None, limit=None):
+        """See GameStore.find_position()."""
+        with self.lock:
+            return self._conn.execute(
+                "SELECT game_id, MIN(ply) FROM positions WHERE hash = ? AND game_id > ?"
+                " GROUP BY game_id ORDER BY game_id LIMIT ?",
+                (_signed(zobrist), after if after is not None else "",
+                 limit if limit is not None else -1)).fetchall()
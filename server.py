@@ -1,34 +1,235 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, stream_with_context
+import hmac
 import os
-import json
 import atexit
+import logging
+import time
+import game_io
+import game_store
+import metrics
+from bitboard import WHITE, Position
+from game import Game, IllegalMove, decode_move, encode_move
+from events import EventHub
+from game_store import GameNotFound, MemoryGameStore, SQLiteGameStore, StalePly
+from idempotency import KeyReused, RecentResults
+from logs import setup_logging
+from waiters import GameWaiters, TooManyWaiters
+import wire
 
 GAMES_FILE = "games.json"
-
+JOURNAL_FILE = "games.journal"
+# Seconds between batched journal fsyncs (0 = fsync every write) and
+# number of journal records that triggers a background snapshot
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("JOURNAL_FSYNC_INTERVAL", "0.2"))
+JOURNAL_COMPACT_RECORDS = int(os.environ.get("JOURNAL_COMPACT_RECORDS", "10000"))
+# "memory" keeps games in this process (single worker only); "sqlite" shares
+# them between gunicorn workers through GAMES_DB
+GAME_STORE = os.environ.get("GAME_STORE", "memory")
+GAMES_DB = os.environ.get("GAMES_DB", "games.sqlite3")
+# /board keeps a FEN every this many plies, so a historical board costs at
+# most this many replayed moves
+BOARD_CHECKPOINT_PLIES = int(os.environ.get("BOARD_CHECKPOINT_PLIES", "20"))
+if BOARD_CHECKPOINT_PLIES < 1:
+    raise ValueError(f"BOARD_CHECKPOINT_PLIES must be at least 1, not {BOARD_CHECKPOINT_PLIES}")
+BATCH_MAX_OPS = 32          # sub-operations accepted by one /batch request
+LOBBY_PAGE_SIZE = 100       # default `limit` for /games and /games/open
+LOBBY_MAX_PAGE_SIZE = 500
+LOBBY_CACHE_SIZE = 256      # cached serialized lobby pages per generation
+MOVE_REQUEST_ID_MAX = 64     # characters in a /move request_id
+MOVE_RESULTS_PER_DEVICE = 32  # /move results kept per device for retries with the same request_id
+MOVE_RESULTS_DEVICES = 10000
+# /moves/wait parks a worker thread, so it needs threaded workers (see
+# render.yaml), and the cap must stay below gunicorn's --timeout (30 s)
+LONGPOLL_TIMEOUT = 20.0      # default seconds a /moves/wait request may block
+LONGPOLL_MAX_TIMEOUT = 25.0  # hard cap so clients can't pin a worker forever
+# At most WEB_THREADS - LONGPOLL_FREE_THREADS clients wait at once, so some
+# threads always remain for /move and the rest; past that /moves/wait
+# answers at once, with Retry-After, and the board polls instead
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))  # gunicorn --threads
+LONGPOLL_FREE_THREADS = int(os.environ.get("LONGPOLL_FREE_THREADS", "8"))
+LONGPOLL_RETRY_AFTER = 5     # seconds a refused waiter should wait before asking again
+# Memory store: games unused for EVICT_IDLE_SECONDS, or finished and unused for
+# EVICT_FINISHED_SECONDS, and the least recently used beyond EVICT_MAX_HOT_GAMES
+# move to ARCHIVE_FILE and come back on their next access (0 disables a rule)
+ARCHIVE_FILE = "games.archive"
+# Memory store: /search/position index, on disk; rebuilt from the games if lost
+POSITIONS_FILE = "games.positions"
+EVICT_IDLE_SECONDS = float(os.environ.get("EVICT_IDLE_SECONDS", str(24 * 3600)))
+EVICT_FINISHED_SECONDS = float(os.environ.get("EVICT_FINISHED_SECONDS", "3600"))
+EVICT_MAX_HOT_GAMES = int(os.environ.get("EVICT_MAX_HOT_GAMES", "100000"))
+EVICT_INTERVAL = float(os.environ.get("EVICT_INTERVAL", "60"))
+# /export and /import: games per store page or store write while streaming,
+# and how many rejected games /import lists. Both need `Authorization:
+# Bearer $ADMIN_TOKEN` (exports carry device ids, which authorize moves);
+# without an ADMIN_TOKEN neither is available
+EXPORT_PAGE_SIZE = 100
+IMPORT_BATCH_SIZE = 100
+IMPORT_MAX_ERRORS = 20
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Spectators: SSE (/events) and WebSocket (/ws) from an asyncio hub on its own
+# port in this process, 0 = off. It only sees moves made by this process, so
+# it needs a single worker (gunicorn -w 1); see events.py
+EVENTS_HOST = os.environ.get("EVENTS_HOST", "0.0.0.0")
+EVENTS_PORT = int(os.environ.get("EVENTS_PORT", "0"))
+EVENTS_QUEUE_SIZE = 64        # events a spectator may fall behind before it is dropped
+EVENTS_MAX_SUBSCRIBERS = 10000
+# DEBUG adds a line per move; LOG_FORMAT=json writes one JSON object per line
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+
+setup_logging(LOG_LEVEL, LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+Game.checkpoint_interval = BOARD_CHECKPOINT_PLIES
 
 app = Flask(__name__)
-games = {}
-
-def save_games():
+waiters = GameWaiters(limit=max(WEB_THREADS - LONGPOLL_FREE_THREADS, 0))
+lobby_cache = {}  # (route, after, limit, format) -> (lobby generation, serialized body)
+recent_moves = RecentResults(MOVE_RESULTS_PER_DEVICE, MOVE_RESULTS_DEVICES)
+
+def event_snapshot(game_id):
+    """Fields of the initial event a spectator gets, None for an unknown game."""
+    game = store.get(game_id)
+    if game is None:
+        return None
     try:
-        with open(GAMES_FILE, "w") as f:
-            json.dump(games, f)
-        print("💾 Game data saved to disk.")
-    except Exception as e:
-        print(f"❌ Failed to save game data: {e}")
+        moves = store.moves(game_id)
+    except GameNotFound:
+        return None
+    return {"usernames": game["usernames"], "moves": moves, "ply": len(moves), "epoch": game["epoch"]}
+
+
+hub = EventHub(EVENTS_HOST, EVENTS_PORT, snapshot=event_snapshot, queue_size=EVENTS_QUEUE_SIZE,
+               max_subscribers=EVENTS_MAX_SUBSCRIBERS)
+
+
+def make_store():
+    """The configured store, not loaded yet; its files are relative to the working directory."""
+    if GAME_STORE == "sqlite":
+        store = SQLiteGameStore(GAMES_DB)
+    else:
+        store = MemoryGameStore(GAMES_FILE, JOURNAL_FILE,
+                                fsync_interval=JOURNAL_FSYNC_INTERVAL,
+                                compact_every=JOURNAL_COMPACT_RECORDS,
+                                archive_path=ARCHIVE_FILE,
+                                idle_seconds=EVICT_IDLE_SECONDS,
+                                finished_seconds=EVICT_FINISHED_SECONDS,
+                                max_hot=EVICT_MAX_HOT_GAMES,
+                                evict_interval=EVICT_INTERVAL,
+                                positions_path=POSITIONS_FILE)
+    # Published by the store under the game's lock, so spectators get a game's changes in order
+    store.add_listener(hub.publish)
+    return store
+
+
+store = make_store()
 
 def load_games():
-    global games
-    if os.path.exists(GAMES_FILE):
-        try:
-            with open(GAMES_FILE, "r") as f:
-                games.update(json.load(f))
-            print("📥 Game data loaded from disk.")
-        except Exception as e:
-            print(f"❌ Failed to load game data: {e}")
+    try:
+        store.load()
+        logger.info("📥 Game data loaded", extra={"store": GAME_STORE, "games": store.counts()[0]})
+    except Exception:
+        # Don't start on an empty store: the next compaction would overwrite the history
+        logger.exception("❌ Failed to load game data")
+        raise
 
 load_games()
 
+if EVENTS_PORT:
+    try:
+        hub.start()
+        logger.info("📡 Event hub listening", extra={"host": EVENTS_HOST, "port": hub.port})
+    except OSError:
+        # Most likely a second worker process: moves still work, spectators use the first one
+        logger.exception("❌ Event hub could not start", extra={"port": EVENTS_PORT})
+
+
+request_count = metrics.Counter("chess_http_requests_total", "HTTP requests by route, method and status",
+                                ("route", "method", "code"))
+request_seconds = metrics.Histogram("chess_http_request_duration_seconds", "HTTP request latency by route",
+                                    ("route", "method"))
+metrics.Gauge("chess_games", "Games in the store", lambda: store.counts()[0])
+metrics.Gauge("chess_open_games", "Games waiting for a second player", lambda: store.counts()[1])
+metrics.Gauge("chess_waiting_clients", "Clients blocked in /moves/wait", waiters.waiting)
+longpoll_refused = metrics.Counter("chess_longpoll_refused_total",
+                                   "/moves/wait requests answered at once because every waiting slot was taken")
+metrics.Gauge("chess_event_subscribers", "Spectators connected to the event hub", hub.subscribers)
+metrics.Gauge("chess_recent_move_results", "/move results kept for retries", lambda: len(recent_moves))
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # Label by route pattern, not path, so the series count stays bounded
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_seconds.observe(time.perf_counter() - g.started, route, request.method)
+    request_count.inc(route, request.method, str(response.status_code))
+    return response
+
+
+# ✅ Prometheus scrape endpoint: per-route counters and latencies, store gauges
+# and persistence timings of this worker
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def response_format():
+    """Negotiated response format: json, text or bin, from ?fmt= or else the Accept header."""
+    fmt = request.args.get("fmt")
+    if fmt in ("json", "text", "bin"):
+        return fmt
+    best = request.accept_mimetypes.best_match(["application/json", wire.TEXT_MIMETYPE, wire.BINARY_MIMETYPE],
+                                               default="application/json")
+    return {wire.TEXT_MIMETYPE: "text", wire.BINARY_MIMETYPE: "bin"}.get(best, "json")
+
+
+def encode_body(body, code, fmt):
+    if fmt == "json":
+        return jsonify(body).get_data()
+    return wire.encode(body, code, fmt)
+
+
+def respond_bytes(data, fmt, code=200):
+    response = app.response_class(data, status=code, mimetype=wire.MIMETYPES.get(fmt, "application/json"))
+    response.vary.add("Accept")
+    return response
+
+
+def respond(body, code=200):
+    """Encode a response body in the format the client asked for (JSON by default)."""
+    fmt = response_format()
+    return respond_bytes(encode_body(body, code, fmt), fmt, code)
+
+
+def game_etag(game, *variant):
+    # Derived from the version alone, so an unchanged poll is answered
+    # before any moves are fetched or serialized
+    fmt = response_format()
+    return "-".join([format(game["created"], "x"), str(game["version"])] +
+                    ["_" if v is None else str(v) for v in variant] +
+                    ([fmt] if fmt != "json" else []))
+
+
+def not_modified(etag):
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.vary.add("Accept")
+        return response
+    return None
+
+
+def tagged(response, etag):
+    response.set_etag(etag)
+    return response
+
+
 @app.route("/start", methods=["POST"])
 def start_game():
     data = request.get_json()
@@ -38,34 +239,24 @@ def start_game():
     pin = data.get("pin")  # Optional PIN
 
     if not game_id or not device_id:
-        return jsonify({"status": "error", "message": "Missing game_id or device_id"}), 400
+        return respond({"status": "error", "message": "Missing game_id or device_id"}, 400)
 
-    if game_id not in games:
-        # New game
-        games[game_id] = {
-            "owners": [device_id],
-            "usernames": [username or ""],
-            "moves": [],
-            "pin": pin or None
-        }
-        return jsonify({"status": "ok", "message": f"Game '{game_id}' created"})
+    result = store.seat(game_id, device_id, username, pin, create=True)
 
-    game = games[game_id]
+    if result == game_store.CREATED:
+        return respond({"status": "ok", "message": f"Game '{game_id}' created"})
 
-    if device_id in game["owners"]:
-        return jsonify({"status": "ok", "message": "Rejoined your own game"})
+    if result == game_store.REJOINED:
+        return respond({"status": "ok", "message": "Rejoined your own game"})
 
-    if len(game["owners"]) >= 2:
-        return jsonify({"status": "error", "message": "Game already has two players"}), 403
+    if result == game_store.FULL:
+        return respond({"status": "error", "message": "Game already has two players"}, 403)
 
-    if game.get("pin"):
-        if pin != game["pin"]:
-            return jsonify({"status": "error", "message": "Incorrect or missing invitation PIN"}), 403
+    if result == game_store.BAD_PIN:
+        return respond({"status": "error", "message": "Incorrect or missing invitation PIN"}, 403)
 
-    # Add second player
-    game["owners"].append(device_id)
-    game["usernames"].append(username or "")
-    return jsonify({"status": "ok", "message": "Joined game as second player"})
+    # Added second player
+    return respond({"status": "ok", "message": "Joined game as second player"})
 
 
 
@@ -78,45 +269,416 @@ def ping():
 
 
 
-@app.route("/move", methods=["POST"])
-def post_move():
-    data = request.get_json()
-    game_id = data.get("game_id")
-    move = data.get("move")
-    device_id = data.get("device_id")
+# The *_result functions hold the logic of the routes below and return
+# (body, status code), so /batch can run them without a Flask request each.
+
+def game_not_found():
+    return {"status": "error", "message": "Game not found"}, 404
+
 
+def move_result(game_id, device_id, move, ply=None, request_id=None):
+    """Append a move. With `ply` (the number of moves the client has) it is only
+    applied if the game is still there; with `request_id` a retry of the same
+    request gets the first answer instead of being applied again, and reusing
+    it for another move gets 409."""
     if not game_id or not move or not device_id:
-        return jsonify({"status": "error", "message": "Missing fields"}), 400
+        return {"status": "error", "message": "Missing fields"}, 400
+    if ply is not None and (not isinstance(ply, int) or isinstance(ply, bool) or ply < 0):
+        return {"status": "error", "message": "'ply' must be a non-negative integer"}, 400
+    if request_id is not None and (not isinstance(request_id, str) or not request_id or
+                                   len(request_id) > MOVE_REQUEST_ID_MAX):
+        return {"status": "error",
+                "message": f"'request_id' must be a string of 1 to {MOVE_REQUEST_ID_MAX} characters"}, 400
+
+    try:
+        move = decode_move(encode_move(move))  # canonical UCI, e.g. "E7E8Q" -> "e7e8q"
+    except ValueError:
+        return {"status": "error", "message": f"Invalid move '{move}'"}, 400
+
+    game = store.get(game_id)
+    if game is None:
+        return game_not_found()
+
+    if device_id not in game["owners"]:
+        return {"status": "error", "message": "Unauthorized"}, 403
+
+    if request_id is None:
+        return apply_move(game_id, move, ply)
+    try:
+        return recent_moves.run(device_id, (game_id, request_id), lambda: apply_move(game_id, move, ply),
+                                fingerprint=(move, ply))
+    except KeyReused:
+        return {"status": "error", "message": f"request_id '{request_id}' was already used for another move"}, 409
+
+
+def move_recorded(move, move_count):
+    return {"status": "ok", "message": f"Move '{move}' recorded", "ply": move_count}, 200
 
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
 
-    game = games[game_id]
+def apply_move(game_id, move, ply):
+    try:
+        move_count = store.add_move(game_id, move, ply)
+    except GameNotFound:
+        return game_not_found()
+    except IllegalMove:
+        return {"status": "error", "message": f"Illegal move '{move}'"}, 400
+    except StalePly:
+        return stale_ply_result(game_id, move, ply)
+    waiters.notify(game_id)
+    logger.debug("🎮 Move recorded", extra={"game_id": game_id, "move": move})
+    return move_recorded(move, move_count)
+
+
+def stale_ply_result(game_id, move, ply):
+    """The answer to a move sent for `ply` when the game is at another ply:
+    the original success if that very move is already there (a resubmission
+    whose answer got lost), else 409 with the moves the client is missing."""
+    game = store.get(game_id)
+    if game is None:
+        return game_not_found()
+    try:
+        if ply < game["move_count"] and store.moves(game_id, ply)[:1] == [move]:
+            return move_recorded(move, ply + 1)
+        body, _ = moves_result(game_id, game, since=ply)
+    except GameNotFound:
+        return game_not_found()
+    body["status"] = "error"
+    body["message"] = f"Game is at ply {game['move_count']}, not {ply}"
+    return body, 409
+
+
+def last_move_result(game_id, game):
+    return {"status": "ok", "move": store.last_move(game_id)}, 200
+
+
+def moves_result(game_id, game, since=None, epoch=None):
+    reset = since is not None and (since > game["move_count"] or
+                                   (epoch is not None and epoch != game["epoch"]))
+    start = 0 if since is None or reset else max(since, 0)
+    moves = store.moves(game_id, start)
+    body = {
+        "status": "ok",
+        "moves": moves,
+        "move_count": start + len(moves),
+        "version": game["version"],
+        "epoch": game["epoch"]
+    }
+    if since is not None:
+        body["since"] = start
+        body["reset"] = reset
+    return body, 200
+
+
+def status_result(game_id, game):
+    # turn/check/result are null for games stored before moves were validated
+    position = store.position(game_id)
+    return {
+        "status": "ok",
+        "game_id": game_id,
+        "owners": game["owners"],
+        "usernames": game["usernames"],
+        "move_count": game["move_count"],
+        "version": game["version"],
+        "epoch": game["epoch"],
+        "turn": ("white" if position.turn == WHITE else "black") if position else None,
+        "check": position.in_check() if position else None,
+        "result": position.outcome() if position else None
+    }, 200
+
+
+def read_route(game_id, result, *variant):
+    """Shared body of the conditional GET routes: 404, 304 or result(game_id, game)."""
+    game = store.get(game_id)
+    if game is None:
+        body, code = game_not_found()
+        return respond(body, code)
+
+    etag = game_etag(game, *variant)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        body, code = result(game_id, game)
+    except GameNotFound:
+        body, code = game_not_found()
+    response = respond(body, code)
+    return tagged(response, etag) if code == 200 else response
 
-    if "owners" not in game or device_id not in game["owners"]:
-        return jsonify({"status": "error", "message": "Unauthorized"}), 403
 
-    game["moves"].append(move)
-    print(f"🎮 Game '{game_id}' moves: {game['moves']}")
-    return jsonify({"status": "ok", "message": f"Move '{move}' recorded"})
+@app.route("/move", methods=["POST"])
+def post_move():
+    data = request.get_json()
+    body, code = move_result(data.get("game_id"), data.get("device_id"), data.get("move"),
+                             data.get("ply"), data.get("request_id"))
+    return respond(body, code)
 
 
 @app.route("/lastmove", methods=["GET"])
 def get_last_move():
-    game_id = request.args.get("game_id")
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
-    if not games[game_id]["moves"]:
-        return jsonify({"status": "ok", "move": None})
-    return jsonify({"status": "ok", "move": games[game_id]["moves"][-1]})
+    return read_route(request.args.get("game_id"), last_move_result)
 
 
+# ✅ Full move list, or only the plies after `since`. `reset` tells the client
+# to throw away its local history (the game was reset since it last synced).
 @app.route("/moves", methods=["GET"])
 def get_move_list():
+    since = request.args.get("since", type=int)
+    epoch = request.args.get("epoch", type=int)
+    return read_route(request.args.get("game_id"),
+                      lambda game_id, game: moves_result(game_id, game, since, epoch),
+                      since, epoch)
+
+
+# ✅ Current board as FEN, or the board after `ply` moves, so a reconnecting board
+# doesn't have to replay the move list itself
+@app.route("/board", methods=["GET"])
+def get_board():
     game_id = request.args.get("game_id")
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
-    return jsonify({"status": "ok", "moves": games[game_id]["moves"]})
+    ply = request.args.get("ply", type=int)
+
+    game = store.get(game_id)
+    if game is None:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+
+    etag = game_etag(game, ply)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        fen = store.board(game_id, ply)
+    except GameNotFound:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+    except IndexError:
+        return respond({"status": "error", "message": f"Ply must be between 0 and {game['move_count']}"}, 400)
+    if fen is None:
+        return respond({"status": "error", "message": "Board unavailable: game has unvalidated moves"}, 409)
+
+    return tagged(respond({
+        "status": "ok",
+        "game_id": game_id,
+        "ply": game["move_count"] if ply is None else ply,
+        "fen": fen
+    }), etag)
+
+
+# ✅ Games that reached a position (given as FEN) and the first ply at which each did,
+# paginated like /games. Looked up by Zobrist hash, so the cost depends on the
+# number of matches, not of games; move counters in the FEN are ignored.
+@app.route("/search/position", methods=["GET"])
+def search_position():
+    fen = request.args.get("fen")
+    if not fen:
+        return respond({"status": "error", "message": "Missing fen"}, 400)
+    try:
+        position = Position.from_fen(fen)
+    except ValueError as e:
+        return respond({"status": "error", "message": str(e)}, 400)
+    after = request.args.get("after") or None
+    limit = request.args.get("limit", default=LOBBY_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), LOBBY_MAX_PAGE_SIZE)
+
+    found = store.find_position(position.zobrist, after, limit + 1)
+    return respond({
+        "status": "ok",
+        "games": [{"game_id": game_id, "ply": ply} for game_id, ply in found[:limit]],
+        "next": found[limit - 1][0] if len(found) > limit else None
+    })
+
+
+def is_admin():
+    header = request.headers.get("Authorization", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(header.encode(), f"Bearer {ADMIN_TOKEN}".encode())
+
+
+def export_ids(ids, open_only, after):
+    """Game ids to export, in order, fetched from the store a page at a time."""
+    if ids is not None:
+        yield from ids
+        return
+    while True:
+        if open_only:
+            page = [game_id for game_id, _ in store.open_games(after, EXPORT_PAGE_SIZE)]
+        else:
+            page = store.game_ids(after, EXPORT_PAGE_SIZE)
+        yield from page
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after = page[-1]
+
+
+# ✅ Every game, or those listed in `ids` (comma-separated), or the open ones
+# (`open=1`), after `after`, as NDJSON (default) or PGN (`format=pgn`). Streamed
+# a page of games at a time, so memory doesn't grow with the number of games.
+@app.route("/export", methods=["GET"])
+def export_games():
+    if not is_admin():
+        return respond({"status": "error", "message": "Export needs the admin token"}, 403)
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "pgn"):
+        return respond({"status": "error", "message": "format must be ndjson or pgn"}, 400)
+    ids = [game_id for game_id in request.args.get("ids", "").split(",") if game_id] or None
+    open_only = request.args.get("open") in ("1", "true")
+    after = request.args.get("after") or None
+    encode = game_io.to_pgn if fmt == "pgn" else game_io.to_ndjson
+
+    def generate():
+        chunk = []
+        for game_id in export_ids(ids, open_only, after):
+            exported = store.export_game(game_id)
+            if exported is None:
+                # Deleted while streaming, or an unknown id in `ids`
+                continue
+            chunk.append(encode(game_id, *exported))
+            if len(chunk) >= EXPORT_PAGE_SIZE:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+
+    mimetype = "application/x-chess-pgn" if fmt == "pgn" else "application/x-ndjson"
+    response = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=games.{fmt}"
+    return response
+
+
+# ✅ Load games exported by /export (NDJSON, or PGN with `format=pgn` or a PGN
+# Content-Type) from the streamed request body, IMPORT_BATCH_SIZE games per
+# store write. Games whose id is taken are skipped, never overwritten.
+@app.route("/import", methods=["POST"])
+def import_games():
+    if not is_admin():
+        return respond({"status": "error", "message": "Import needs the admin token"}, 403)
+    fmt = request.args.get("format") or ("pgn" if request.mimetype in ("application/x-chess-pgn",
+                                                                        "application/vnd.chess-pgn") else "ndjson")
+    if fmt not in ("ndjson", "pgn"):
+        return respond({"status": "error", "message": "format must be ndjson or pgn"}, 400)
+    read = game_io.read_pgn if fmt == "pgn" else game_io.read_ndjson
+    lines = (line.decode("utf-8", "replace") for line in request.stream)
+
+    counts = {game_store.IMPORTED: 0, game_store.EXISTS: 0}
+    invalid = 0
+    errors = []
+
+    def flush(batch):
+        for result in store.import_games(batch):
+            counts[result] += 1
+
+    batch = []
+    for data, error in read(lines):
+        if error:
+            invalid += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append(error)
+            continue
+        batch.append(data)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    logger.info("📥 Games imported", extra=dict(counts, invalid=invalid, format=fmt))
+    return respond({"status": "ok", "imported": counts[game_store.IMPORTED], "exists": counts[game_store.EXISTS],
+                    "invalid": invalid, "errors": errors})
+
+
+def batch_op_result(op):
+    if not isinstance(op, dict):
+        return {"status": "error", "message": "Operation must be an object"}, 400
+    name = op.get("op")
+    game_id = op.get("game_id")
+
+    if name == "move":
+        return move_result(game_id, op.get("device_id"), op.get("move"), op.get("ply"), op.get("request_id"))
+
+    readers = {
+        "status": status_result,
+        "lastmove": last_move_result,
+        "moves": lambda game_id, game: moves_result(game_id, game, op.get("since"), op.get("epoch"))
+    }
+    if name not in readers:
+        return {"status": "error", "message": f"Unknown op '{name}'"}, 400
+    for field in ("since", "epoch", "version"):
+        if op.get(field) is not None and not isinstance(op[field], int):
+            return {"status": "error", "message": f"'{field}' must be an integer"}, 400
+
+    game = store.get(game_id)
+    if game is None:
+        return game_not_found()
+    # Like If-None-Match: the client already has this version
+    if op.get("version") is not None and op["version"] == game["version"]:
+        return {"status": "ok", "version": game["version"]}, 304
+    body, code = readers[name](game_id, game)
+    body.setdefault("version", game["version"])
+    return body, code
+
+
+# ✅ Several status/lastmove/moves/move operations in one request, for boards following
+# several games. Each result carries its own HTTP-style `code`; one failing op
+# doesn't fail the batch.
+@app.route("/batch", methods=["POST"])
+def batch():
+    data = request.get_json(silent=True) or {}
+    ops = data.get("ops")
+    if not isinstance(ops, list) or not ops:
+        return respond({"status": "error", "message": "Missing ops"}, 400)
+    if len(ops) > BATCH_MAX_OPS:
+        return respond({"status": "error", "message": f"At most {BATCH_MAX_OPS} ops per batch"}, 400)
+
+    results = []
+    for op in ops:
+        try:
+            body, code = batch_op_result(op)
+        except GameNotFound:
+            body, code = game_not_found()
+        except Exception:
+            logger.exception("❌ Batch op failed", extra={"op": repr(op)})
+            body, code = {"status": "error", "message": "Internal error"}, 500
+        body["code"] = code
+        results.append(body)
+    return respond({"status": "ok", "results": results})
+
+
+# ✅ Block until the game has moved past `since` plies (or was reset), instead of polling /lastmove
+@app.route("/moves/wait", methods=["GET"])
+def wait_for_moves():
+    game_id = request.args.get("game_id")
+    since = max(request.args.get("since", default=0, type=int), 0)
+    epoch = request.args.get("epoch", type=int)
+    timeout = request.args.get("timeout", default=LONGPOLL_TIMEOUT, type=float)
+    timeout = min(max(timeout, 0.0), LONGPOLL_MAX_TIMEOUT)
+
+    if store.get(game_id) is None:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+
+    def changed():
+        game = store.get(game_id)
+        return (game is None or game["move_count"] != since or
+                (epoch is not None and game["epoch"] != epoch))
+
+    refused = False
+    try:
+        waiters.wait(game_id, changed, timeout, poll_interval=store.poll_interval)
+    except TooManyWaiters:
+        # Every thread we may park is taken: answer now rather than starve /move
+        refused = True
+        longpoll_refused.inc()
+
+    game = store.get(game_id)
+    if game is None:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+
+    # Same answer as /moves: after a reset the whole list, from ply 0
+    try:
+        body, code = moves_result(game_id, game, since, epoch)
+    except GameNotFound:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+    response = respond(body, code)
+    if refused:
+        response.headers["Retry-After"] = str(LONGPOLL_RETRY_AFTER)
+    return response
 
 
 @app.route("/reset", methods=["POST"])
@@ -126,42 +688,67 @@ def reset_game():
     device_id = data.get("device_id")
 
     if not game_id or not device_id:
-        return jsonify({"status": "error", "message": "Missing game_id or device_id"}), 400
+        return respond({"status": "error", "message": "Missing game_id or device_id"}, 400)
 
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
+    game = store.get(game_id)
+    if game is None:
+        return respond({"status": "error", "message": "Game not found"}, 404)
 
-    game = games[game_id]
+    if device_id not in game["owners"]:
+        return respond({"status": "error", "message": "Unauthorized"}, 403)
 
-    if "owners" not in game or device_id not in game["owners"]:
-        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    try:
+        store.reset(game_id)
+    except GameNotFound:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+    waiters.notify(game_id)
+    logger.info("🔄 Game reset", extra={"game_id": game_id, "device_id": device_id})
+    return respond({"status": "ok", "message": f"Game '{game_id}' reset"})
+
+def lobby_page(route, fetch):
+    """Serve a paginated lobby listing, reusing the serialized page until the lobby changes.
+
+    fetch(after, limit) returns (items, cursor_of_each_item) for at most limit items.
+    """
+    after = request.args.get("after") or None
+    limit = request.args.get("limit", default=LOBBY_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), LOBBY_MAX_PAGE_SIZE)
+
+    fmt = response_format()
+    key = (route, after, limit, fmt)
+    generation = store.lobby_generation()
+    cached = lobby_cache.get(key)
+    if cached and cached[0] == generation:
+        return respond_bytes(cached[1], fmt)
+
+    # One extra item tells us whether there is a next page
+    items, cursors = fetch(after, limit + 1)
+    more = len(items) > limit
+    body = encode_body({
+        "status": "ok",
+        route: items[:limit],
+        "next": cursors[limit - 1] if more else None
+    }, 200, fmt)
+
+    if len(lobby_cache) >= LOBBY_CACHE_SIZE:
+        lobby_cache.clear()
+    lobby_cache[key] = (generation, body)
+    return respond_bytes(body, fmt)
 
-    game["moves"] = []
-    print(f"🔄 Game '{game_id}' has been reset by {device_id}")
-    print(f"🎮 Game '{game_id}' moves: {game['moves']}")
-    return jsonify({"status": "ok", "message": f"Game '{game_id}' reset"})
 
-# ✅ Get full list of active game IDs (for listing or debug)
+# ✅ Get the list of game IDs, a page at a time (`limit`, and `after` = the previous page's `next`)
 @app.route("/games", methods=["GET"])
 def list_games():
-    return jsonify({"status": "ok", "games": list(games.keys())})
+    def fetch(after, limit):
+        ids = store.game_ids(after, limit)
+        return ids, ids
+    return lobby_page("games", fetch)
 
 
 # ✅ Get detailed status of a specific game
 @app.route("/status", methods=["GET"])
 def game_status():
-    game_id = request.args.get("game_id")
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
-
-    game = games[game_id]
-    return jsonify({
-        "status": "ok",
-        "game_id": game_id,
-        "owners": game.get("owners", []),
-        "usernames": game.get("usernames", []),
-        "move_count": len(game.get("moves", []))
-    })
+    return read_route(request.args.get("game_id"), status_result)
 
 # ✅ Delete a game (only by an owner)
 @app.route("/delete", methods=["POST"])
@@ -171,29 +758,31 @@ def delete_game():
     device_id = data.get("device_id")
 
     if not game_id or not device_id:
-        return jsonify({"status": "error", "message": "Missing game_id or device_id"}), 400
-
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
+        return respond({"status": "error", "message": "Missing game_id or device_id"}, 400)
 
-    game = games[game_id]
-    if device_id not in game.get("owners", []):
-        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    game = store.get(game_id)
+    if game is None:
+        return respond({"status": "error", "message": "Game not found"}, 404)
 
-    del games[game_id]
-    print(f"❌ Game '{game_id}' deleted by {device_id}")
-    return jsonify({"status": "ok", "message": f"Game '{game_id}' deleted"})
+    if device_id not in game["owners"]:
+        return respond({"status": "error", "message": "Unauthorized"}, 403)
 
+    try:
+        store.delete(game_id)
+    except GameNotFound:
+        return respond({"status": "error", "message": "Game not found"}, 404)
+    waiters.notify(game_id)
+    logger.info("❌ Game deleted", extra={"game_id": game_id, "device_id": device_id})
+    return respond({"status": "ok", "message": f"Game '{game_id}' deleted"})
+
+# ✅ Games waiting for a second player, paginated like /games
 @app.route("/games/open", methods=["GET"])
 def list_open_games():
-    open_games = []
-    for game_id, game in games.items():
-        if len(game.get("owners", [])) == 1:
-            open_games.append({
-                "game_id": game_id,
-                "username": game.get("usernames", [""])[0]
-            })
-    return jsonify({"status": "ok", "open_games": open_games})
+    def fetch(after, limit):
+        page = store.open_games(after, limit)
+        return ([{"game_id": game_id, "username": username} for game_id, username in page],
+                [game_id for game_id, _ in page])
+    return lobby_page("open_games", fetch)
 
 @app.route("/join", methods=["POST"])
 def join_game():
@@ -204,32 +793,29 @@ def join_game():
     pin = data.get("pin")  # Optional PIN
 
     if not game_id or not device_id:
-        return jsonify({"status": "error", "message": "Missing game_id or device_id"}), 400
+        return respond({"status": "error", "message": "Missing game_id or device_id"}, 400)
 
-    if game_id not in games:
-        return jsonify({"status": "error", "message": "Game not found"}), 404
+    result = store.seat(game_id, device_id, username, pin)
 
-    game = games[game_id]
+    if result == game_store.NOT_FOUND:
+        return respond({"status": "error", "message": "Game not found"}, 404)
 
-    if device_id in game["owners"]:
-        return jsonify({"status": "ok", "message": "Rejoined your own game"})
+    if result == game_store.REJOINED:
+        return respond({"status": "ok", "message": "Rejoined your own game"})
 
-    if len(game["owners"]) >= 2:
-        return jsonify({"status": "error", "message": "Game already has two players"}), 403
+    if result == game_store.FULL:
+        return respond({"status": "error", "message": "Game already has two players"}, 403)
 
-    if game.get("pin"):
-        if pin != game["pin"]:
-            return jsonify({"status": "error", "message": "Incorrect or missing invitation PIN"}), 403
+    if result == game_store.BAD_PIN:
+        return respond({"status": "error", "message": "Incorrect or missing invitation PIN"}, 403)
 
-    game["owners"].append(device_id)
-    game["usernames"].append(username or "")
-    return jsonify({"status": "ok", "message": f"Joined game '{game_id}' as second player"})
+    return respond({"status": "ok", "message": f"Joined game '{game_id}' as second player"})
 
 
 
 
-atexit.register(save_games)
+atexit.register(store.close)
+atexit.register(hub.close)
 
 if __name__ == "__main__":
     app.run(debug=True)
-
@@ -0,0 +1,69 @@
+import threading
+import time
+
+
+class TooManyWaiters(Exception):
+    """wait() was called while `limit` clients were already waiting."""
+
+
+class GameWaiters:
+    """Per-game wakeups for long-polling clients.
+
+    A condition variable only exists while somebody is waiting on that game,
+    so idle games cost nothing and a notify on a game nobody watches is a
+    single dict lookup.
+
+    Each waiting client holds a thread, so at most `limit` (None: no limit)
+    may wait at once; wait() refuses the others with TooManyWaiters.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._entries = {}  # game_id -> [Condition, number of waiters]
+        self._count = 0
+
+    def wait(self, game_id, predicate, timeout, poll_interval=None):
+        """Block until predicate() is true or timeout expires; return its value.
+
+        With poll_interval set, predicate() is also re-checked that often, for
+        state changes made by other processes that can't call notify().
+        Raises TooManyWaiters without waiting if `limit` clients already are.
+        """
+        with self._lock:
+            if self.limit is not None and self._count >= self.limit:
+                raise TooManyWaiters(self._count)
+            self._count += 1
+            entry = self._entries.get(game_id)
+            if entry is None:
+                entry = self._entries[game_id] = [threading.Condition(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if poll_interval is None:
+                    return entry[0].wait_for(predicate, timeout)
+                deadline = time.monotonic() + timeout
+                while True:
+                    result = predicate()
+                    remaining = deadline - time.monotonic()
+                    if result or remaining <= 0:
+                        return result
+                    entry[0].wait(min(remaining, poll_interval))
+        finally:
+            with self._lock:
+                self._count -= 1
+                entry[1] -= 1
+                if entry[1] == 0 and self._entries.get(game_id) is entry:
+                    del self._entries[game_id]
+
+    def notify(self, game_id):
+        """Wake every client waiting on game_id. Call after the state changed."""
+        with self._lock:
+            entry = self._entries.get(game_id)
+        if entry is not None:
+            with entry[0]:
+                entry[0].notify_all()
+
+    def waiting(self):
+        with self._lock:
+            return self._count
@@ -0,0 +1,195 @@
+"""Compact response encodings for microcontroller clients.
+
+Every route builds a JSON-style body dict; encode() turns it into one of:
+
+text  (text/plain) one "key<TAB>value" line per field, preceded by a line
+      holding the numeric HTTP status. Lists are tab-separated on one line,
+      lists of objects are flattened to "key.index.field" lines. Moves are
+      packed move codes in decimal (see game.encode_move), booleans 1/0,
+      null "-". The "status" field is dropped: the first line says it all.
+
+bin   (application/x-chess-bin) a frame of
+          magic 0xC5, version 1, uint16 status, uint8 field count, fields
+      where each field is uint8 key id (KEYS index, or 0xFF followed by a
+      uint8-length key name), uint8 type and a type-specific payload; all
+      integers little-endian. Moves travel as uint16 codes.
+"""
+import struct
+
+from game import encode_move
+
+TEXT_MIMETYPE = "text/plain"
+BINARY_MIMETYPE = "application/x-chess-bin"
+MIMETYPES = {"text": TEXT_MIMETYPE, "bin": BINARY_MIMETYPE}
+
+MAGIC = 0xC5
+VERSION = 1
+
+# Wire ids of known keys; append only, never reorder
+KEYS = ["message", "game_id", "move", "moves", "move_count", "version", "epoch", "since", "reset",
+        "owners", "usernames", "turn", "check", "result", "fen", "ply", "games", "open_games",
+        "username", "next", "results", "code"]
+KEY_IDS = {key: i for i, key in enumerate(KEYS)}
+UNKNOWN_KEY = 0xFF
+
+# Field types
+T_NULL, T_BOOL, T_INT32, T_INT64, T_STR, T_MOVES, T_STRS, T_OBJECTS, T_MOVE = range(9)
+
+# Keys whose values are UCI moves and go out as packed codes
+MOVE_KEYS = ("move", "moves")
+
+
+def _clean(value):
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+def _text_value(key, value):
+    if value is None:
+        return "-"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if key in MOVE_KEYS:
+        if isinstance(value, list):
+            return "\t".join(str(encode_move(m)) for m in value)
+        return str(encode_move(value))
+    if isinstance(value, (list, tuple)):
+        return "\t".join(_clean(v) for v in value)
+    return _clean(value)
+
+
+def _text_lines(body, prefix, lines):
+    for key, value in body.items():
+        if key == "status":
+            continue
+        if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+            for i, item in enumerate(value):
+                _text_lines(item, f"{prefix}{key}.{i}.", lines)
+        else:
+            lines.append(f"{prefix}{key}\t{_text_value(key, value)}")
+    return lines
+
+
+def encode_text(body, code):
+    return ("\n".join(_text_lines(body, "", [str(code)])) + "\n").encode("utf-8")
+
+
+def _pack_str(value):
+    data = str(value).encode("utf-8")[:0xFFFF]
+    return struct.pack("<H", len(data)) + data
+
+
+def _pack_fields(body):
+    fields = [(k, v) for k, v in body.items() if k != "status"]
+    out = [struct.pack("<B", len(fields))]
+    for key, value in fields:
+        key_id = KEY_IDS.get(key)
+        if key_id is None:
+            name = key.encode("utf-8")[:255]
+            out.append(struct.pack("<BB", UNKNOWN_KEY, len(name)) + name)
+        else:
+            out.append(struct.pack("<B", key_id))
+
+        if value is None:
+            out.append(struct.pack("<B", T_NULL))
+        elif isinstance(value, bool):
+            out.append(struct.pack("<BB", T_BOOL, value))
+        elif isinstance(value, int):
+            if -2**31 <= value < 2**31:
+                out.append(struct.pack("<Bi", T_INT32, value))
+            else:
+                out.append(struct.pack("<Bq", T_INT64, value))
+        elif key in MOVE_KEYS and isinstance(value, str):
+            out.append(struct.pack("<BH", T_MOVE, encode_move(value)))
+        elif key in MOVE_KEYS:
+            codes = [encode_move(m) for m in value]
+            out.append(struct.pack(f"<BH{len(codes)}H", T_MOVES, len(codes), *codes))
+        elif isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+            out.append(struct.pack("<BH", T_OBJECTS, len(value)))
+            out.extend(_pack_fields(item) for item in value)
+        elif isinstance(value, (list, tuple)):
+            out.append(struct.pack("<BH", T_STRS, len(value)))
+            out.extend(_pack_str(v) for v in value)
+        else:
+            out.append(struct.pack("<B", T_STR) + _pack_str(value))
+    return b"".join(out)
+
+
+def encode_binary(body, code):
+    return struct.pack("<BBH", MAGIC, VERSION, code) + _pack_fields(body)
+
+
+ENCODERS = {"text": encode_text, "bin": encode_binary}
+
+
+def encode(body, code, fmt):
+    return ENCODERS[fmt](body, code)
+
+
+def decode_binary(data):
+    """Inverse of encode_binary, for tests and the benchmark: returns (code, body)."""
+    magic, version, code = struct.unpack_from("<BBH", data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a chess-bin frame")
+    body, _ = _unpack_fields(data, 4)
+    return code, body
+
+
+def _unpack_str(data, offset):
+    (length,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def _unpack_fields(data, offset):
+    (count,) = struct.unpack_from("<B", data, offset)
+    offset += 1
+    body = {}
+    for _ in range(count):
+        key_id, = struct.unpack_from("<B", data, offset)
+        offset += 1
+        if key_id == UNKNOWN_KEY:
+            (length,) = struct.unpack_from("<B", data, offset)
+            key = data[offset + 1:offset + 1 + length].decode("utf-8")
+            offset += 1 + length
+        else:
+            key = KEYS[key_id]
+        (kind,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        if kind == T_NULL:
+            value = None
+        elif kind == T_BOOL:
+            value = bool(data[offset])
+            offset += 1
+        elif kind == T_INT32:
+            (value,) = struct.unpack_from("<i", data, offset)
+            offset += 4
+        elif kind == T_INT64:
+            (value,) = struct.unpack_from("<q", data, offset)
+            offset += 8
+        elif kind == T_MOVE:
+            (value,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+        elif kind == T_MOVES:
+            (n,) = struct.unpack_from("<H", data, offset)
+            value = list(struct.unpack_from(f"<{n}H", data, offset + 2))
+            offset += 2 + 2 * n
+        elif kind == T_STR:
+            value, offset = _unpack_str(data, offset)
+        elif kind == T_STRS:
+            (n,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            value = []
+            for _ in range(n):
+                item, offset = _unpack_str(data, offset)
+                value.append(item)
+        elif kind == T_OBJECTS:
+            (n,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            value = []
+            for _ in range(n):
+                item, offset = _unpack_fields(data, offset)
+                value.append(item)
+        else:
+            raise ValueError(f"Unknown field type {kind}")
+        body[key] = value
+    return body, offset